@@ -0,0 +1,53 @@
+import sys
+import time
+from pathlib import Path
+import numpy as np
+from image_analysis import ImageContext, preprocess_score_batch
+from inference_backends import BACKENDS, load_backend, top1_agreement
+from model_registry import get_model_name, get_target_size, load_model_class
+
+# Usage: python backend-parity-check.py <model type> <backend> <image folder> [number of images] [quantize y/n]
+# Compares the top-1 class of a converted scoring model with the Keras model and times both
+
+# Lowest accepted share of images with the same top-1 class
+MIN_AGREEMENT = 0.99
+BATCH_SIZE = 32
+
+if len(sys.argv) not in [4, 5, 6] or sys.argv[2] not in BACKENDS:
+    exit("Usage: python backend-parity-check.py <model type> <backend> <image folder> [number of images] "
+         "[quantize y/n]")
+
+model_type = int(sys.argv[1])
+backend = sys.argv[2]
+quantize = len(sys.argv) == 6 and sys.argv[5] == "y"
+target_size = get_target_size(model_type)
+
+valid_extensions = ('.png', '.jpg', '.jpeg')
+image_files = sorted(file_path for file_path in Path(sys.argv[3]).rglob('*')
+                     if file_path.suffix.lower() in valid_extensions)
+image_files = image_files[:int(sys.argv[4]) if len(sys.argv) >= 5 else 200]
+if not image_files:
+    exit("No images found.")
+
+batches = []
+for start in range(0, len(image_files), BATCH_SIZE):
+    images = [ImageContext(file_path).resized(target_size) for file_path in image_files[start:start + BATCH_SIZE]]
+    batches.append(preprocess_score_batch(model_type, np.stack(images)))
+
+
+def run(inference_backend):
+    start = time.perf_counter()
+    predictions = np.concatenate([inference_backend.predict(batch) for batch in batches])
+    return predictions, len(image_files) / (time.perf_counter() - start)
+
+
+build_model = lambda: load_model_class(model_type)(weights='imagenet')
+reference_predictions, reference_speed = run(load_backend("keras", build_model, target_size + (3,), ""))
+predictions, speed = run(load_backend(backend, build_model, target_size + (3,), get_model_name(model_type),
+                                      quantize=quantize))
+
+agreement = top1_agreement(reference_predictions, predictions)
+print(f"keras: {reference_speed:.1f} images/s, {backend}{' int8' if quantize else ''}: {speed:.1f} images/s")
+print(f"Top-1 agreement: {agreement:.2%} of {len(image_files)} images")
+if agreement < MIN_AGREEMENT:
+    exit(f"Agreement is below {MIN_AGREEMENT:.0%}.")
@@ -0,0 +1,50 @@
+# Folder ranges of the filter, shared with the results manifest queries
+
+# Constants for NSFW ranges
+NSFW_RANGES = [
+    (0.0, 0.2),
+    (0.2, 0.4),
+    (0.4, 0.6),
+    (0.6, 0.8),
+    (0.8, 0.9),
+    (0.9, 0.95),
+    (0.95, 0.99),
+    (0.99, 0.995),
+    (0.995, 1.0)
+]
+
+# Constants for score ranges
+SCORE_RANGES_SMALL = [
+    (0.0, 0.2),
+    (0.2, 0.4),
+    (0.4, 0.6),
+    (0.6, 0.8),
+    (0.8, 1.0)
+]
+
+SCORE_RANGES_BIG = [
+    (0, 2),
+    (2, 4),
+    (4, 6),
+    (6, 8),
+    (8, 10)
+]
+
+SMALL_SCORE_MODELS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27,
+                      28, 29, 30, 31, 32, 33]
+BIG_SCORE_MODELS = [34, 35, 36, 37, 38]
+
+
+# Function to check the range for a value and return the corresponding folder name
+def get_folder_name(value, ranges):
+    if value is None:
+        return 'None'
+    for i, (start, end) in enumerate(ranges):
+        if start <= value < end:
+            return f"{start}-{end}"
+    return 'None'
+
+
+def get_score_ranges(model_type):
+    # Score ranges of the folders of a scoring model
+    return SCORE_RANGES_BIG if model_type in BIG_SCORE_MODELS else SCORE_RANGES_SMALL
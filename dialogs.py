@@ -0,0 +1,39 @@
+from pathlib import Path
+
+# Qt is started with the first dialog, so runs that never show one work on headless servers
+app = None
+
+
+def _ensure_application():
+    global app
+    if app is None:
+        from PyQt5.QtWidgets import QApplication
+        app = QApplication([])
+
+
+def get_folder_path(message):
+    _ensure_application()
+    from PyQt5.QtWidgets import QFileDialog
+    while True:
+        print(message)
+        folder_path_input = QFileDialog().getExistingDirectory(None, message)
+
+        if folder_path_input:
+            folder_path = Path(folder_path_input)
+            return folder_path
+        else:
+            print("Invalid input selected. Please try again.\n")
+
+
+def get_file_path(message, file_filter="All files (*)"):
+    _ensure_application()
+    from PyQt5.QtWidgets import QFileDialog
+    while True:
+        print(message)
+        file_path_input, _ = QFileDialog.getOpenFileName(None, message, filter=file_filter)
+
+        if file_path_input:
+            file_path = Path(file_path_input)
+            return file_path
+        else:
+            print("Invalid input selected. Please try again.\n")
@@ -0,0 +1,10 @@
+import hashlib
+
+# Digests that can be computed, by column name
+HASH_ALGORITHMS = {"MD5": "md5", "SHA1": "sha1", "SHA256": "sha256"}
+
+
+def hash_data(data, algorithms=("MD5", "SHA1", "SHA256")):
+    # Every digest is computed from the same content, read once by the caller. hashlib releases the GIL while it
+    # hashes large buffers, so several reader threads hash at once.
+    return {name: hashlib.new(HASH_ALGORITHMS[name], data).hexdigest() for name in algorithms}
@@ -0,0 +1,277 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# How a copied image is written: a byte copy, a hard link, a copy-on-write clone, a relative symbolic link,
+# or "auto" for the cheapest of clone, hard link and copy the file system supports
+LINK_MODES = ["copy", "hardlink", "reflink", "symlink", "auto"]
+
+# ioctl cloning a whole file on Btrfs, XFS and other copy-on-write file systems
+FICLONE = 0x40049409
+
+# Checks of a move to another file system before its source is removed: none, the size, or the SHA256
+VERIFY_MODES = ["n", "size", "sha256"]
+
+# Buffer of the copies between file systems, large enough for a whole typical image
+COPY_BUFFER_SIZE = 16 * 1024 * 1024
+
+# Held while a line is printed, see print_line
+print_lock = threading.Lock()
+
+
+def reflink(file_path, destination_file_path):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("Reflinks are not supported on this platform")
+    with open(file_path, "rb") as source, open(destination_file_path, "xb") as destination:
+        try:
+            fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+        except OSError:
+            destination.close()
+            os.remove(destination_file_path)
+            raise
+
+
+def symlink(file_path, destination_file_path):
+    # Relative, so the link survives moving the input and output folders together
+    os.symlink(os.path.relpath(os.path.abspath(file_path), os.path.abspath(destination_file_path.parent)),
+               destination_file_path)
+
+
+def print_line(message=""):
+    # Every line printed while the file operations run goes through one lock, so the lines of the workers and of
+    # the main thread don't mix
+    with print_lock:
+        print(message, flush=True)
+
+
+def sync_directory(folder):
+    # Makes a rename in the folder durable, Windows can't open folders and doesn't need it
+    if os.name == "nt":
+        return
+    descriptor = os.open(folder, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def copy_file(file_path, destination_file_path, verify="n", durable=False):
+    """Copy with a large buffer into a temporary file next to the destination and rename it into place.
+
+    A failed copy (a full disk, a failed check) never leaves a partial image under the destination name. With
+    durable the copy and the rename are synced to disk, so the caller can remove the source afterwards.
+    """
+    temporary_path = destination_file_path.with_name(f".{destination_file_path.name}.{os.getpid()}.tmp")
+    try:
+        source_hash = hashlib.sha256() if verify == "sha256" else None
+        with open(file_path, "rb") as source, open(temporary_path, "wb") as destination:
+            while True:
+                chunk = source.read(COPY_BUFFER_SIZE)
+                if not chunk:
+                    break
+                if source_hash is not None:
+                    source_hash.update(chunk)
+                destination.write(chunk)
+            if durable:
+                destination.flush()
+                os.fsync(destination.fileno())
+        shutil.copystat(file_path, temporary_path)
+
+        if verify == "size" and os.path.getsize(temporary_path) != os.path.getsize(file_path):
+            raise OSError(f"Size of the copy of '{file_path}' differs, the source was kept")
+        if verify == "sha256":
+            destination_hash = hashlib.sha256()
+            with open(temporary_path, "rb") as destination:
+                for chunk in iter(lambda: destination.read(COPY_BUFFER_SIZE), b""):
+                    destination_hash.update(chunk)
+            if destination_hash.digest() != source_hash.digest():
+                raise OSError(f"SHA256 of the copy of '{file_path}' differs, the source was kept")
+        os.replace(temporary_path, destination_file_path)
+    except BaseException:
+        try:
+            os.remove(temporary_path)
+        except FileNotFoundError:
+            pass
+        raise
+    if durable:
+        sync_directory(destination_file_path.parent)
+
+
+def materialize(file_path, destination_file_path, link_mode):
+    # Returns the method that was used, any link that can't be created falls back to a byte copy
+    if link_mode == "auto":
+        methods = [("Cloned", reflink), ("Hardlinked", os.link)]
+    elif link_mode == "reflink":
+        methods = [("Cloned", reflink)]
+    elif link_mode == "hardlink":
+        methods = [("Hardlinked", os.link)]
+    elif link_mode == "symlink":
+        methods = [("Symlinked", symlink)]
+    else:
+        methods = []
+
+    for name, method in methods:
+        try:
+            # Different file systems, unsupported file systems and missing permissions all raise OSError
+            method(file_path, destination_file_path)
+            return name
+        except OSError:
+            continue
+    copy_file(file_path, destination_file_path)
+    return "Copied"
+
+
+class FileOperationExecutor:
+    """Runs a routing plan: a list of (file_path, [(destination_folder, move), ...]) entries.
+
+    Each destination folder is created and listed once, later collisions are checked against that listing
+    instead of the file system. refresh() drops the listings, for long runs where other programs change the
+    folders; names of operations that are still running stay claimed. The moves/copies run in a thread pool. With dry_run the plan is only printed
+    and, if plan_file is set, appended to it as JSON lines.
+    """
+
+    def __init__(self, workers=4, queue_depth=256, dry_run=False, plan_file=None, link_mode="copy", verify="n"):
+        self.dry_run = dry_run
+        self.link_mode = link_mode
+        self.verify = verify
+        self.plan_file = open(plan_file, "a", encoding="utf-8") if plan_file is not None else None
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # Block while too many operations are waiting for the file workers
+        self.queue_slots = threading.BoundedSemaphore(queue_depth)
+        # Names in each destination folder: its listing plus every name claimed since it was listed
+        self.folder_names = {}
+        # Names of the operations submitted but not finished, by destination folder
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        # Device of each destination folder, a move to the same device is a rename
+        self.folder_devices = {}
+
+        # Per-run counts by operation and bytes written, reported on shutdown
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self._start_time = time.monotonic()
+
+    def refresh(self):
+        # The folders are listed again when they are next used
+        self.folder_names = {}
+
+    def _names_in(self, destination_folder):
+        if destination_folder not in self.folder_names:
+            # Taken before the listing: an operation finishing in between is in one of the two
+            with self._in_flight_lock:
+                in_flight = set(self._in_flight.get(destination_folder, ()))
+            try:
+                self.folder_names[destination_folder] = set(os.listdir(destination_folder)) | in_flight
+            except FileNotFoundError:
+                if not self.dry_run:
+                    destination_folder.mkdir(parents=True, exist_ok=True)
+                self.folder_names[destination_folder] = in_flight
+            if not self.dry_run:
+                self.folder_devices[destination_folder] = os.stat(destination_folder).st_dev
+        return self.folder_names[destination_folder]
+
+    def execute(self, plan):
+        # Returns (file_path, [(destination_folder, future), ...]) per entry, the future is None for skipped
+        # images and in a dry run
+        executed = []
+        for file_path, destinations in plan:
+            transfers = []
+            for destination_folder, move in destinations:
+                transfers.append((destination_folder, self._submit(file_path, destination_folder, move)))
+            executed.append((file_path, transfers))
+        if self.plan_file is not None:
+            self.plan_file.flush()
+        return executed
+
+    def _submit(self, file_path, destination_folder, move):
+        names = self._names_in(destination_folder)
+        if file_path.name in names:
+            print_line(f"Skipped image '{file_path.name}' as it already exists in the destination folder.")
+            self._count("Skipped")
+            return None
+        names.add(file_path.name)
+
+        operation = "move" if move else self.link_mode
+        if self.plan_file is not None:
+            self.plan_file.write(json.dumps({"source": str(file_path), "destination": str(destination_folder),
+                                             "operation": operation}) + "\n")
+        if self.dry_run:
+            print_line(f"Plan: {operation} {file_path} -> {destination_folder}")
+            return None
+
+        self.queue_slots.acquire()
+        with self._in_flight_lock:
+            self._in_flight.setdefault(destination_folder, set()).add(file_path.name)
+        future = self.executor.submit(self._transfer, file_path, destination_folder / file_path.name, move)
+        future.add_done_callback(self._finish)
+        return future
+
+    def _transfer(self, file_path, destination_file_path, move):
+        try:
+            self._run_transfer(file_path, destination_file_path, move)
+        finally:
+            with self._in_flight_lock:
+                self._in_flight[destination_file_path.parent].discard(destination_file_path.name)
+
+    def _run_transfer(self, file_path, destination_file_path, move):
+        # Runs in the file operation pool, the folder exists and the name is free
+        size = os.path.getsize(file_path)
+        if move:
+            print_line(f"Image: {file_path.name} -> Move to folder: {destination_file_path.parent}")
+            method = self._move(file_path, destination_file_path)
+        else:
+            print_line(f"Image: {file_path.name} -> Copy to folder: {destination_file_path.parent}")
+            method = materialize(file_path, destination_file_path, self.link_mode)
+        print_line(f"{method} image to {destination_file_path}")
+        # Renames and links don't write the image data
+        self._count(method, size if method in ["Moved", "Copied"] else 0)
+
+    def _move(self, file_path, destination_file_path):
+        if os.stat(file_path).st_dev == self.folder_devices[destination_file_path.parent]:
+            try:
+                os.rename(file_path, destination_file_path)
+                return "Renamed"
+            except OSError as e:
+                # Bind mounts and overlay file systems can report the same device
+                if e.errno != errno.EXDEV:
+                    raise
+        # The copy is on disk before the only other copy of the image is removed
+        copy_file(file_path, destination_file_path, self.verify, durable=True)
+        os.remove(file_path)
+        return "Moved"
+
+    def _count(self, operation, size=0):
+        with self._stats_lock:
+            self.stats[operation] += 1
+            self.stats["bytes"] += size
+
+    def _finish(self, future):
+        self.queue_slots.release()
+        if future.exception() is not None:
+            print_line(f"File operation failed: {str(future.exception())}")
+            self._count("Failed")
+
+    def report(self):
+        elapsed = max(time.monotonic() - self._start_time, 1e-9)
+        operations = sum(count for operation, count in self.stats.items() if operation not in ["bytes", "Skipped"])
+        counts = ", ".join(f"{count} {operation.lower()}" for operation, count in sorted(self.stats.items())
+                           if operation != "bytes")
+        print(f"File operations: {counts or 'none'}")
+        print(f"{self.stats['bytes'] / 1024 ** 2:.1f} MB written in {elapsed:.1f}s "
+              f"({self.stats['bytes'] / 1024 ** 2 / elapsed:.1f} MB/s, {operations / elapsed:.1f} files/s)")
+
+    def shutdown(self):
+        # Wait for the remaining file operations
+        self.executor.shutdown(wait=True)
+        if self.plan_file is not None:
+            self.plan_file.close()
+        if not self.dry_run:
+            self.report()
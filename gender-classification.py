@@ -1,95 +1,25 @@
 import os
 import numpy as np
-from tensorflow.keras.applications import (Xception, VGG16, VGG19, ResNet50, ResNet50V2, ResNet101, ResNet101V2,
-                                           ResNet152, ResNet152V2, InceptionV3, InceptionResNetV2, MobileNet,
-                                           MobileNetV2, DenseNet121, DenseNet169, DenseNet201, NASNetMobile,
-                                           NASNetLarge, EfficientNetB0, EfficientNetB1, EfficientNetB2, EfficientNetB3,
-                                           EfficientNetB4, EfficientNetB5, EfficientNetB6, EfficientNetB7,
-                                           EfficientNetV2B0, EfficientNetV2B1, EfficientNetV2B2, EfficientNetV2B3,
-                                           EfficientNetV2S, EfficientNetV2M, EfficientNetV2L, ConvNeXtTiny,
-                                           ConvNeXtSmall, ConvNeXtBase, ConvNeXtLarge, ConvNeXtXLarge)
 from tensorflow.keras.layers import GlobalAveragePooling2D, Dense
 from tensorflow.keras.models import Model
 from tensorflow.keras.preprocessing import image
 import shutil
-from PyQt5.QtWidgets import QApplication, QFileDialog
 from pathlib import Path
+from dialogs import get_folder_path, get_file_path
+from inference_backends import load_backend
+from model_registry import get_model_name, get_target_size, load_model_class
 
 input_folder = None
 output_folder = None
 model_file = None
 model_type = None
 
-print("Initializing...")
-
-# Create the application
-app = QApplication([])
-
-# Model selection dictionary
-MODEL_SELECTION = {
-    1: Xception,
-    2: VGG16,
-    3: VGG19,
-    4: ResNet50,
-    5: ResNet50V2,
-    6: ResNet101,
-    7: ResNet101V2,
-    8: ResNet152,
-    9: ResNet152V2,
-    10: InceptionV3,
-    11: InceptionResNetV2,
-    12: MobileNet,
-    13: MobileNetV2,
-    14: DenseNet121,
-    15: DenseNet169,
-    16: DenseNet201,
-    17: NASNetMobile,
-    18: NASNetLarge,
-    19: EfficientNetB0,
-    20: EfficientNetB1,
-    21: EfficientNetB2,
-    22: EfficientNetB3,
-    23: EfficientNetB4,
-    24: EfficientNetB5,
-    25: EfficientNetB6,
-    26: EfficientNetB7,
-    27: EfficientNetV2B0,
-    28: EfficientNetV2B1,
-    29: EfficientNetV2B2,
-    30: EfficientNetV2B3,
-    31: EfficientNetV2S,
-    32: EfficientNetV2M,
-    33: EfficientNetV2L,
-    34: ConvNeXtTiny,
-    35: ConvNeXtSmall,
-    36: ConvNeXtBase,
-    37: ConvNeXtLarge,
-    38: ConvNeXtXLarge
-}
-
-
-def get_folder_path(message):
-    while True:
-        print(message)
-        folder_path_input = QFileDialog().getExistingDirectory(None, message)
-
-        if folder_path_input:
-            folder_path = Path(folder_path_input)
-            return folder_path
-        else:
-            print("Invalid input selected. Please try again.\n")
-
-
-def get_file_path(message):
-    while True:
-        print(message)
-        file_path_input, _ = QFileDialog.getOpenFileName(None, message, filter="Model files (*.h5);;All files (*)")
+# Runtime of the model: "keras", "onnx" or "tflite", see the inference backends in the README
+inference_backend = "keras"
+quantize = "n"
+model_cache_folder = "model_cache"
 
-        if file_path_input:
-            file_path = Path(file_path_input)
-            return file_path
-        else:
-            print("Invalid input selected. Please try again.\n")
+print("Initializing...")
 
 
 # Define a function to predict gender
@@ -130,55 +60,36 @@ if model_type is None:
         invalid_input()
 
 # Determine the input shape based on the selected model_type
-if model_type in [2, 3, 4, 5, 6, 7, 8, 9, 12, 13, 14, 15, 16, 17, 19, 27, 34, 35, 36, 37, 38]:
-    input_shape = (224, 224, 3)
-elif model_type in [20, 28]:
-    input_shape = (240, 240, 3)
-elif model_type in [21, 29]:
-    input_shape = (260, 260, 3)
-elif model_type in [1, 10, 11]:
-    input_shape = (299, 299, 3)
-elif model_type in [22, 30]:
-    input_shape = (300, 300, 3)
-elif model_type in [18]:
-    input_shape = (331, 331, 3)
-elif model_type in [23]:
-    input_shape = (380, 380, 3)
-elif model_type in [31]:
-    input_shape = (384, 384, 3)
-elif model_type in [24]:
-    input_shape = (456, 456, 3)
-elif model_type in [32, 33]:
-    input_shape = (480, 480, 3)
-elif model_type in [25]:
-    input_shape = (528, 528, 3)
-elif model_type in [26]:
-    input_shape = (600, 600, 3)
-else:
-    exit("Error 1")
-
-print("Loading model: " + MODEL_SELECTION[int(model_type)])
-# Load the pre-trained model with the determined input shape
-base_model = MODEL_SELECTION[int(model_type)](weights='imagenet', include_top=False, input_shape=input_shape)
-
-# Add custom layers for gender classification
-x = base_model.output
-x = GlobalAveragePooling2D()(x)
-x = Dense(128, activation='relu')(x)
-predictions = Dense(4, activation='softmax')(x)  # Adjust the output layer for 4 classes
-
-model = Model(inputs=base_model.input, outputs=predictions)
-
-print("Model loaded")
+input_shape = get_target_size(model_type) + (3,)
 
 # Add code to select the model file
 if model_file is None:
-    model_file = get_file_path("Choose your model file")
+    model_file = get_file_path("Choose your model file", "Model files (*.h5);;All files (*)")
+
+
+def build_gender_model():
+    print("Loading model: " + get_model_name(model_type))
+    # Load the pre-trained model with the determined input shape
+    base_model = load_model_class(model_type)(weights='imagenet', include_top=False, input_shape=input_shape)
+
+    # Add custom layers for gender classification
+    x = base_model.output
+    x = GlobalAveragePooling2D()(x)
+    x = Dense(128, activation='relu')(x)
+    predictions = Dense(4, activation='softmax')(x)  # Adjust the output layer for 4 classes
+
+    gender_model = Model(inputs=base_model.input, outputs=predictions)
+
+    # Load the trained weights for gender classification
+    gender_model.load_weights(str(model_file))
+    print("Model loaded")
+    return gender_model
+
 
-print("Loading model: " + MODEL_SELECTION[int(model_type)])
-# Load the trained weights for gender classification
-model.load_weights(str(model_file))
-print("Model loaded")
+# Converted models are cached per weights file, retrained weights are converted again
+artifact_name = f"gender-{Path(model_file).stem}-{os.stat(model_file).st_mtime_ns}"
+model = load_backend(inference_backend, build_gender_model, input_shape, artifact_name, model_cache_folder,
+                     quantize == "y")
 
 # Define input directory
 if input_folder is None:
@@ -1,16 +1,8 @@
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
-from tensorflow.keras.applications import (Xception, VGG16, VGG19, ResNet50, ResNet50V2, ResNet101, ResNet101V2,
-                                           ResNet152, ResNet152V2, InceptionV3, InceptionResNetV2, MobileNet,
-                                           MobileNetV2, DenseNet121, DenseNet169, DenseNet201, NASNetMobile,
-                                           NASNetLarge, EfficientNetB0, EfficientNetB1, EfficientNetB2, EfficientNetB3,
-                                           EfficientNetB4, EfficientNetB5, EfficientNetB6, EfficientNetB7,
-                                           EfficientNetV2B0, EfficientNetV2B1, EfficientNetV2B2, EfficientNetV2B3,
-                                           EfficientNetV2S, EfficientNetV2M, EfficientNetV2L, ConvNeXtTiny,
-                                           ConvNeXtSmall, ConvNeXtBase, ConvNeXtLarge, ConvNeXtXLarge)
 from tensorflow.keras.layers import Dense, GlobalAveragePooling2D
 from tensorflow.keras.models import Model
-from PyQt5.QtWidgets import QApplication, QFileDialog
-from pathlib import Path
+from dialogs import get_folder_path
+from model_registry import get_model_name, get_target_size, load_model_class
 
 input_folder = None
 output_folder = None
@@ -19,63 +11,6 @@ num_classes = 4
 
 print("Initializing...")
 
-# Create the application
-app = QApplication([])
-
-# Model selection dictionary
-MODEL_SELECTION = {
-    1: Xception,
-    2: VGG16,
-    3: VGG19,
-    4: ResNet50,
-    5: ResNet50V2,
-    6: ResNet101,
-    7: ResNet101V2,
-    8: ResNet152,
-    9: ResNet152V2,
-    10: InceptionV3,
-    11: InceptionResNetV2,
-    12: MobileNet,
-    13: MobileNetV2,
-    14: DenseNet121,
-    15: DenseNet169,
-    16: DenseNet201,
-    17: NASNetMobile,
-    18: NASNetLarge,
-    19: EfficientNetB0,
-    20: EfficientNetB1,
-    21: EfficientNetB2,
-    22: EfficientNetB3,
-    23: EfficientNetB4,
-    24: EfficientNetB5,
-    25: EfficientNetB6,
-    26: EfficientNetB7,
-    27: EfficientNetV2B0,
-    28: EfficientNetV2B1,
-    29: EfficientNetV2B2,
-    30: EfficientNetV2B3,
-    31: EfficientNetV2S,
-    32: EfficientNetV2M,
-    33: EfficientNetV2L,
-    34: ConvNeXtTiny,
-    35: ConvNeXtSmall,
-    36: ConvNeXtBase,
-    37: ConvNeXtLarge,
-    38: ConvNeXtXLarge
-}
-
-
-def get_folder_path(message):
-    while True:
-        print(message)
-        folder_path_input = QFileDialog().getExistingDirectory(None, message)
-
-        if folder_path_input:
-            folder_path = Path(folder_path_input)
-            return folder_path
-        else:
-            print("Invalid input selected. Please try again.\n")
-
 
 def invalid_input():
     print("Invalid input. Please try again.\n")
@@ -100,32 +35,7 @@ if model_type is None:
         invalid_input()
 
 # Determine the input shape based on the selected model_type
-if model_type in [2, 3, 4, 5, 6, 7, 8, 9, 12, 13, 14, 15, 16, 17, 19, 27, 34, 35, 36, 37, 38]:
-    input_shape = (224, 224)
-elif model_type in [20, 28]:
-    input_shape = (240, 240)
-elif model_type in [21, 29]:
-    input_shape = (260, 260)
-elif model_type in [1, 10, 11]:
-    input_shape = (299, 299)
-elif model_type in [22, 30]:
-    input_shape = (300, 300)
-elif model_type in [18]:
-    input_shape = (331, 331)
-elif model_type in [23]:
-    input_shape = (380, 380)
-elif model_type in [31]:
-    input_shape = (384, 384)
-elif model_type in [24]:
-    input_shape = (456, 456)
-elif model_type in [32, 33]:
-    input_shape = (480, 480)
-elif model_type in [25]:
-    input_shape = (528, 528)
-elif model_type in [26]:
-    input_shape = (600, 600)
-else:
-    exit("Error 1")
+input_shape = get_target_size(model_type)
 
 # Define input directory
 if input_folder is None:
@@ -158,9 +68,9 @@ train_generator = train_datagen.flow_from_directory(
     shuffle=True
 )
 
-print("Loading model: " + MODEL_SELECTION[int(model_type)])
+print("Loading model: " + get_model_name(model_type))
 # Load the pre-trained MobileNetV2 model (excluding the top layer)
-base_model = MODEL_SELECTION[int(model_type)](weights='imagenet', include_top=False)
+base_model = load_model_class(model_type)(weights='imagenet', include_top=False)
 
 # Add custom layers for gender classification
 x = base_model.output
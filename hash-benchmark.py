@@ -0,0 +1,94 @@
+import hashlib
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from metadata_extraction import read_image
+from png_metadata import read_parameters
+
+# Usage: python hash-benchmark.py [number of files] [file size in KB] [read workers]
+# Reads a synthetic tree of PNG files with A1111 parameters and random pixel data: the old sequential MD5 + SHA1 +
+# SHA256 in 4 KB chunks followed by a second read of the header, against the read stage of the extraction
+# pipeline (read_image in read_workers threads), with all three digests and with SHA256 only
+
+FILE_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+FILE_SIZE = int(sys.argv[2]) * 1024 if len(sys.argv) > 2 else 64 * 1024
+WORKERS = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+FILES_PER_FOLDER = 1000
+
+
+def read_image_before(file_path):
+    # The reading of metadata_extraction.py before the read stage: the hashing, then the header
+    hashermd5 = hashlib.md5()
+    hashersha1 = hashlib.sha1()
+    hashersha256 = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while True:
+            chunk = file.read(4096)
+            if not chunk:
+                break
+            hashermd5.update(chunk)
+            hashersha1.update(chunk)
+            hashersha256.update(chunk)
+    digests = {"MD5": hashermd5.hexdigest(), "SHA1": hashersha1.hexdigest(), "SHA256": hashersha256.hexdigest()}
+    return digests, read_parameters(file_path)
+
+
+def png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def create_tree(folder):
+    header = png_chunk(b"IHDR", struct.pack(">IIBBBBB", 512, 512, 8, 2, 0, 0, 0))
+    for index in range(FILE_COUNT):
+        subfolder = os.path.join(folder, f"{index // FILES_PER_FOLDER:04d}")
+        os.makedirs(subfolder, exist_ok=True)
+        parameters = png_chunk(b"tEXt", b"parameters\0a cat, Negative prompt: dog\nSteps: 20, Seed: " +
+                               str(index).encode())
+        with open(os.path.join(subfolder, f"{index:06d}.png"), "wb") as file:
+            file.write(b"\x89PNG\r\n\x1a\n" + header + parameters + png_chunk(b"IDAT", os.urandom(FILE_SIZE)) +
+                       png_chunk(b"IEND", b""))
+
+
+def read_images(file_paths, hashes):
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        return [(digests, metadata) for _, digests, metadata in
+                executor.map(lambda file_path: read_image(file_path, hashes), file_paths)]
+
+
+def list_tree(folder):
+    return sorted(os.path.join(root, filename) for root, dirs, files in os.walk(folder) for filename in files)
+
+
+folder = tempfile.mkdtemp(prefix="hash-benchmark-")
+try:
+    print(f"Creating {FILE_COUNT} files of {FILE_SIZE // 1024} KB in {folder}...")
+    create_tree(folder)
+    file_paths = list_tree(folder)
+    # Read everything once, so every scenario reads from the page cache
+    for file_path in file_paths:
+        with open(file_path, "rb") as file:
+            file.read()
+
+    scenarios = [
+        ("before: sequential, 4 KB chunks, MD5+SHA1+SHA256", lambda: [read_image_before(path) for path in file_paths]),
+        (f"read stage ({WORKERS} threads), MD5+SHA1+SHA256", lambda: read_images(file_paths, ["MD5", "SHA1", "SHA256"])),
+        (f"read stage ({WORKERS} threads), SHA256 only", lambda: read_images(file_paths, ["SHA256"])),
+    ]
+    reference = None
+    for name, run in scenarios:
+        start = time.perf_counter()
+        results = run()
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference = [(digests["SHA256"], metadata) for digests, metadata in results]
+        elif [(digests["SHA256"], metadata) for digests, metadata in results] != reference:
+            exit(f"{name}: SHA256 values or parameters differ from the old reading.")
+        megabytes = FILE_COUNT * FILE_SIZE / 1024 ** 2
+        print(f"{name:<52} {elapsed:>7.2f}s  {FILE_COUNT / elapsed:>8.0f} files/s  {megabytes / elapsed:>7.0f} MB/s")
+finally:
+    shutil.rmtree(folder)
@@ -0,0 +1,430 @@
+import hashlib
+import io
+import os
+import re
+import multiprocessing
+import multiprocessing.connection
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from importlib.metadata import version
+import PIL
+from PIL import Image
+import numpy as np
+from file_operations import print_line
+from inference_backends import load_backend
+from model_registry import get_model_name, get_target_size, load_model_class, load_preprocess_input
+from png_metadata import read_text_chunks
+from result_cache import ResultCache
+
+# Modes using each stage
+NSFW_MODES = [1, 4, 5, 6, 8, 10, 11, 12, 13, 14, 15]
+SCORE_MODES = [2, 4, 6, 7, 9, 10, 11, 12, 13, 14, 15]
+MODEL_MODES = [3, 5, 7, 8, 9, 10, 11, 12, 13, 14, 15]
+PARAMETER_MODES = [16]
+
+# Id of the NSFW model in the result cache, the scoring models use their class name
+NSFW_MODEL_ID = "OpenNSFW2"
+
+# Number of best classes kept from the predictions of the scoring model
+TOP_K = 5
+
+# Define the regular expression pattern for invalid characters
+invalid_chars_pattern = r'[<>:"-_/\\|?*().;#{}[\]\n]'
+
+# Analysis result of a single image, the values of the stages not used by the mode are None
+# class_index, score and top_k belong to the first scoring model, model_scores maps every model type to its top_k
+ImageResult = namedtuple("ImageResult", ["path", "nsfw_probability", "class_index", "score", "top_k",
+                                         "model_name", "parameter_list", "model_scores"])
+
+
+class ImageContext:
+    """Decodes an image file once and derives the input of every stage from that buffer.
+
+    The metadata is read from the file header only, the pixels are decoded on first use. A caller that already
+    read the file passes its content as data. release() drops the file content and the decoded image once the
+    model inputs are prepared, so a context waiting in a queue only holds the small arrays.
+    """
+
+    def __init__(self, file_path, data=None):
+        self.path = file_path
+        self._data = data
+        self._content_hash = None
+        self._info = None
+        self._image = None
+        self._resized = {}
+        self._nsfw_input = None
+
+        # Stage outputs found in the result cache, the scores by model type
+        self.cached_nsfw = None
+        self.cached_scores = {}
+
+    @property
+    def name(self):
+        return self.path.name
+
+    @property
+    def content_hash(self):
+        # The file content is kept in memory until it is decoded, so the file is only read once
+        if self._content_hash is None:
+            if self._data is None:
+                self._data = self.path.read_bytes()
+            self._content_hash = hashlib.sha256(self._data).hexdigest()
+        return self._content_hash
+
+    @property
+    def info(self):
+        if self._info is None:
+            # Parsed from the content in memory when the file was already read
+            self._info = read_text_chunks(self.path, self._data)
+        return self._info
+
+    @property
+    def image(self):
+        if self._image is None:
+            source = io.BytesIO(self._data) if self._data is not None else self.path
+            with Image.open(source) as img:
+                img.load()
+                self._info = dict(img.info)
+                self._image = img.convert("RGB")
+            self._data = None
+        return self._image
+
+    def resized(self, size):
+        # Same result as image.load_img(path, target_size=size), which uses nearest interpolation
+        if size not in self._resized:
+            img = self.image
+            if img.size != size:
+                img = img.resize(size, Image.NEAREST)
+            self._resized[size] = np.asarray(img, dtype=np.float32)
+        return self._resized[size]
+
+    def nsfw_input(self):
+        # Resize, crop to 224 and normalize the same way as n2.predict_image does
+        if self._nsfw_input is None:
+            import opennsfw2 as n2
+            self._nsfw_input = n2.preprocess_image(self.image, n2.Preprocessing.YAHOO)
+        return self._nsfw_input
+
+    def release(self):
+        # A stage that needs another input later decodes the file again
+        self._data = None
+        self._image = None
+
+
+def preprocess_score_batch(model_type, batch):
+    return load_preprocess_input(model_type)(batch)
+
+
+def extract_model_name(context):
+    # Extract the model name from the metadata dictionary
+    params = context.info.get("parameters", "")
+    model_start = params.find("Model:") + len("Model:")
+    model_end = params.find(",", model_start)
+    model_name = params[model_start:model_end].strip()
+    return model_name
+
+
+def extract_parameters(context, split_words):
+    parameter_list = tokenize_parameters(context.info.get("parameters", ""), split_words)
+    if parameter_list is None:
+        exit("Error 6")
+    return parameter_list
+
+
+def tokenize_parameters(params, split_words):
+    # Split the positive prompt into tokens, None if the parameters don't contain a prompt
+    if "Negative prompt:" in params:
+        result = params.split("Negative prompt:", 1)[0].strip()
+    elif "Steps:" in params:
+        result = params.split("Steps:", 1)[0].strip()
+    else:
+        return None
+    cleaned_result = re.sub(invalid_chars_pattern, '', result)
+
+    if ',' not in cleaned_result or split_words:
+        # Split the cleaned folder name by whitespaces and remove invalid characters
+        removed_commas = re.sub(r',', '', cleaned_result)
+        separate_list = re.split(r'\s+', removed_commas)
+    else:
+        # Split the cleaned folder name by commas and remove invalid characters
+        separate_list = re.split(r',', cleaned_result)
+
+    parameter_list = [item.strip() for item in separate_list if item.strip() and len(item.strip()) <= 100]
+    return parameter_list
+
+
+class ImageAnalyzer:
+    """Runs the NSFW, score, model and parameter stages of a mode over batches of images.
+
+    The models needed by the mode are loaded once when the analyzer is created.
+    """
+
+    def __init__(self, mode, model_type=None, split_words=None, batch_size=32, prefetch_workers=4,
+                 prefetch_depth=64, result_cache=None, result_cache_size=1000000, inference_backend="keras",
+                 quantize=False, model_cache_folder="model_cache", inference_threads=None):
+        self.mode = mode
+        # model_type is a single model type or a list of them, every image is scored by each model
+        self.model_types = model_type if isinstance(model_type, list) else [model_type]
+        self.split_words = split_words
+        self.batch_size = batch_size
+        self.prefetch_workers = prefetch_workers
+        self.prefetch_depth = prefetch_depth
+
+        # TensorFlow and opennsfw2 are only imported by the modes running a model
+        self.nsfw_model = None
+        self.score_backends = {}
+        self.score_model_ids = {}
+        if mode in NSFW_MODES:
+            print("Loading NSFW model...")
+            import opennsfw2 as n2
+            self.nsfw_model = n2.make_open_nsfw_model()
+        if mode in SCORE_MODES:
+            import tensorflow as tf
+            self.score_model_version = tf.__version__
+            for score_model_type in self.model_types:
+                self.load_score_model(score_model_type, inference_backend, quantize, model_cache_folder,
+                                      inference_threads)
+
+        # Known images skip the inference, entries of another model version are dropped
+        self.cache = None
+        if result_cache is not None and mode in NSFW_MODES + SCORE_MODES:
+            self.cache = ResultCache(result_cache, result_cache_size)
+            if mode in NSFW_MODES:
+                self.cache.register_model(NSFW_MODEL_ID, version("opennsfw2"))
+            if mode in SCORE_MODES:
+                for score_model_id in self.score_model_ids.values():
+                    self.cache.register_model(score_model_id, self.score_model_version)
+
+    def load_score_model(self, model_type, inference_backend, quantize, model_cache_folder, inference_threads):
+        print(f"Loading scoring model {get_model_name(model_type)}...")
+        self.score_backends[model_type] = load_backend(inference_backend,
+                                                       lambda: load_model_class(model_type)(weights='imagenet'),
+                                                       get_target_size(model_type) + (3,), get_model_name(model_type),
+                                                       model_cache_folder, quantize, inference_threads)
+        # Converted and quantized models give slightly different scores, so they are cached separately
+        score_model_id = get_model_name(model_type)
+        if inference_backend != "keras":
+            score_model_id += f"-{inference_backend}" + ("-int8" if quantize else "")
+        self.score_model_ids[model_type] = score_model_id
+
+    def prepare_context(self, file_path):
+        # Runs in the prefetch pool: read, decode and resize everything the selected mode needs
+        context = ImageContext(file_path)
+        try:
+            if self.cache is not None:
+                if self.mode in NSFW_MODES:
+                    context.cached_nsfw = self.cache.get(context.content_hash, NSFW_MODEL_ID)
+                if self.mode in SCORE_MODES:
+                    for model_type, score_model_id in self.score_model_ids.items():
+                        cached_scores = self.cache.get(context.content_hash, score_model_id)
+                        if cached_scores is not None:
+                            context.cached_scores[model_type] = cached_scores
+            if self.mode in MODEL_MODES + PARAMETER_MODES:
+                context.info
+            if self.mode in NSFW_MODES and context.cached_nsfw is None:
+                context.nsfw_input()
+            if self.mode in SCORE_MODES:
+                # Models sharing an input size share the resized image
+                for model_type in self.model_types:
+                    if model_type not in context.cached_scores:
+                        context.resized(get_target_size(model_type))
+        except (PIL.UnidentifiedImageError, OSError):
+            # The stage using the context reports the error
+            pass
+        # Only the model inputs wait in the prefetch window, not the full-resolution image
+        context.release()
+        return context
+
+    def prefetch_batches(self, file_paths):
+        # Yield the contexts batch by batch while the next images are decoded in the background
+        with ThreadPoolExecutor(max_workers=self.prefetch_workers) as executor:
+            remaining_paths = iter(file_paths)
+            pending = deque()
+            for file_path in remaining_paths:
+                pending.append(executor.submit(self.prepare_context, file_path))
+                if len(pending) >= self.batch_size + self.prefetch_depth:
+                    break
+
+            while pending:
+                batch = []
+                while pending and len(batch) < self.batch_size:
+                    batch.append(pending.popleft().result())
+                    next_path = next(remaining_paths, None)
+                    if next_path is not None:
+                        pending.append(executor.submit(self.prepare_context, next_path))
+                yield batch
+
+    def get_nsfw_probabilities(self, contexts):
+        # Same structure as get_image_scores: cached images are skipped, the rest share one forward pass
+        results = [None] * len(contexts)
+        loaded_indices = []
+        loaded_inputs = []
+        for i, context in enumerate(contexts):
+            if context.cached_nsfw is not None:
+                results[i] = context.cached_nsfw["nsfw_probability"]
+                continue
+            try:
+                loaded_inputs.append(context.nsfw_input())
+            except (PIL.UnidentifiedImageError, OSError) as e:
+                print_line(f"Skipping image '{context.name}' due to an error: {str(e)}")
+                continue
+            loaded_indices.append(i)
+
+        if not loaded_inputs:
+            return results
+
+        # Check NSFW probability using the NSFW detector, the model is built once per process
+        predictions = self.nsfw_model.predict(np.stack(loaded_inputs), batch_size=len(loaded_inputs), verbose=0)
+        for prediction, i in zip(predictions, loaded_indices):
+            results[i] = float(prediction[1])
+            if self.cache is not None:
+                self.cache.put(contexts[i].content_hash, NSFW_MODEL_ID, {"nsfw_probability": results[i]})
+        return results
+
+    def get_image_scores(self, contexts, model_type):
+        # Resize every image of the batch, skipping the cached ones and the ones that can't be decoded
+        results = [None] * len(contexts)
+        loaded_indices = []
+        loaded_images = []
+        for i, context in enumerate(contexts):
+            if model_type in context.cached_scores:
+                results[i] = context.cached_scores[model_type]["top_k"]
+                continue
+            try:
+                loaded_images.append(context.resized(get_target_size(model_type)))
+            except (PIL.UnidentifiedImageError, OSError) as e:
+                # Reported once, not by every model
+                if model_type == self.model_types[0]:
+                    print_line(f"Skipping image '{context.name}' due to an error: {str(e)}")
+                continue
+            loaded_indices.append(i)
+
+        if not loaded_images:
+            return results
+
+        # Run a single forward pass over the whole batch
+        batch = preprocess_score_batch(model_type, np.stack(loaded_images))
+        predictions = self.score_backends[model_type].predict(batch)
+        # Stable sort, so the first class is the one np.argmax picks
+        best_classes = np.argsort(-predictions, axis=1, kind="stable")[:, :TOP_K]
+
+        # Return the best class indices and corresponding scores in input order
+        for prediction, classes, i in zip(predictions, best_classes, loaded_indices):
+            results[i] = [[int(predicted_class), float(prediction[predicted_class])] for predicted_class in classes]
+            if self.cache is not None:
+                self.cache.put(contexts[i].content_hash, self.score_model_ids[model_type], {"top_k": results[i]})
+        return results
+
+    def analyze_batch(self, contexts):
+        # Score the whole batch at once with every model, results are returned in file order
+        scores_by_model = {}
+        if self.mode in SCORE_MODES:
+            for model_type in self.model_types:
+                scores_by_model[model_type] = self.get_image_scores(contexts, model_type)
+
+        if self.mode in NSFW_MODES:
+            nsfw_probabilities = self.get_nsfw_probabilities(contexts)
+        else:
+            nsfw_probabilities = [None] * len(contexts)
+
+        results = []
+        for i, (context, nsfw_probability) in enumerate(zip(contexts, nsfw_probabilities)):
+            model_scores = {model_type: scores[i] for model_type, scores in scores_by_model.items()}
+            top_k = model_scores.get(self.model_types[0])
+            class_index, score = top_k[0] if top_k else (None, None)
+            model_name = extract_model_name(context) if self.mode in MODEL_MODES else None
+            parameter_list = extract_parameters(context, self.split_words) if self.mode in PARAMETER_MODES else None
+            results.append(ImageResult(context.path, nsfw_probability, class_index, score, top_k, model_name,
+                                       parameter_list, model_scores))
+
+        if self.cache is not None:
+            self.cache.commit()
+        return results
+
+    def analyze_files(self, file_paths):
+        # Yield (file_path, result) in file order, each file is decoded at most once in the prefetch pool
+        for batch in self.prefetch_batches(file_paths):
+            for result in self.analyze_batch(batch):
+                yield result.path, result
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+
+def run_worker(shard, settings, threads, connection):
+    # Entry point of a worker process: load the models once and report the results batch by batch
+    if settings["mode"] in NSFW_MODES + SCORE_MODES:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(threads)
+    analyzer = ImageAnalyzer(**settings, inference_threads=threads)
+
+    indices = [index for index, _ in shard]
+    file_paths = [file_path for _, file_path in shard]
+    position = 0
+    for batch in analyzer.prefetch_batches(file_paths):
+        results = analyzer.analyze_batch(batch)
+        connection.send(list(zip(indices[position:position + len(results)], results)))
+        position += len(results)
+    analyzer.close()
+    connection.send(None)
+    connection.close()
+
+
+def analyze_files_in_workers(file_paths, workers, settings):
+    """Split the files across worker processes and yield (file_path, result) in file order.
+
+    Each worker loads its own models. If a worker dies, the results of the other workers are still
+    yielded and the files it didn't report are yielded with a None result.
+    """
+    # Spawned workers don't inherit the TensorFlow state of the parent
+    context = multiprocessing.get_context("spawn")
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    processes = {}
+    unreported = {}
+    connections = {}
+    for worker_id in range(workers):
+        # Interleaved shards keep the workers at a similar position in the file list
+        shard = [(index, file_paths[index]) for index in range(worker_id, len(file_paths), workers)]
+        unreported[worker_id] = {index for index, _ in shard}
+        reader, writer = context.Pipe(duplex=False)
+        process = context.Process(target=run_worker, args=(shard, settings, threads, writer), daemon=True)
+        process.start()
+        # Only the worker holds the writing end, so its exit shows up as EOF
+        writer.close()
+        processes[worker_id] = process
+        connections[reader] = worker_id
+
+    results = {}
+    next_index = 0
+    while connections:
+        for reader in multiprocessing.connection.wait(list(connections)):
+            worker_id = connections[reader]
+            try:
+                batch_results = reader.recv()
+            except EOFError:
+                batch_results = None
+                processes[worker_id].join()
+                print(f"Worker {worker_id} stopped with exit code {processes[worker_id].exitcode}, "
+                      f"{len(unreported[worker_id])} of its images were not analyzed.")
+                for index in unreported[worker_id]:
+                    results[index] = None
+
+            if batch_results is None:
+                del connections[reader]
+                reader.close()
+                continue
+            for index, result in batch_results:
+                results[index] = result
+                unreported[worker_id].discard(index)
+
+        # Hand the results back in file order
+        while next_index in results:
+            yield file_paths[next_index], results.pop(next_index)
+            next_index += 1
+
+    for process in processes.values():
+        process.join()
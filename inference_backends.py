@@ -0,0 +1,122 @@
+import os
+from pathlib import Path
+import numpy as np
+
+# Backends running the Keras models: "keras" runs model.predict, "onnx" and "tflite" convert the model once,
+# store the converted file in the model cache folder and run it without keeping the Keras model in memory
+BACKENDS = ["keras", "onnx", "tflite"]
+
+
+class KerasBackend:
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, batch):
+        return self.model.predict(batch, batch_size=len(batch), verbose=0)
+
+
+class OnnxBackend:
+    def __init__(self, artifact_path, threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            exit("The onnx backend needs onnxruntime and tf2onnx: pip install onnxruntime tf2onnx")
+
+        options = ort.SessionOptions()
+        if threads is not None:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(artifact_path), options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    @staticmethod
+    def convert(model, input_shape, artifact_path, quantize):
+        try:
+            import tf2onnx
+            import tensorflow as tf
+        except ImportError:
+            exit("The onnx backend needs onnxruntime and tf2onnx: pip install onnxruntime tf2onnx")
+
+        # The batch dimension stays dynamic, so the whole batch runs in one call
+        spec = (tf.TensorSpec((None,) + tuple(input_shape), tf.float32, name="input"),)
+        if not quantize:
+            tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=str(artifact_path))
+            return
+
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        fp32_path = artifact_path.with_name(artifact_path.stem + "-fp32.onnx")
+        tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=str(fp32_path))
+        # Dynamic quantization: int8 weights, activations quantized on the fly, no calibration data needed
+        quantize_dynamic(str(fp32_path), str(artifact_path), weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+
+    def predict(self, batch):
+        return self.session.run(None, {self.input_name: np.asarray(batch, dtype=np.float32)})[0]
+
+
+class TFLiteBackend:
+    def __init__(self, artifact_path, threads=None):
+        import tensorflow as tf
+        self.interpreter = tf.lite.Interpreter(model_path=str(artifact_path), num_threads=threads)
+        self.input_index = self.interpreter.get_input_details()[0]["index"]
+        self.output_index = self.interpreter.get_output_details()[0]["index"]
+        self.batch_size = None
+
+    @staticmethod
+    def convert(model, input_shape, artifact_path, quantize):
+        import tensorflow as tf
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        if quantize:
+            # Dynamic range quantization: int8 weights, float activations
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        artifact_path.write_bytes(converter.convert())
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        # The interpreter is resized only when the batch size changes, usually for the last batch
+        if batch.shape[0] != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_index, batch.shape)
+            self.interpreter.allocate_tensors()
+            self.batch_size = batch.shape[0]
+        self.interpreter.set_tensor(self.input_index, batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
+
+
+def get_artifact_path(model_cache_folder, artifact_name, backend, quantize):
+    import tensorflow as tf
+    # Converted files are tied to the TensorFlow version that exported them
+    suffix = "-int8" if quantize else ""
+    extension = ".onnx" if backend == "onnx" else ".tflite"
+    return Path(model_cache_folder) / f"{artifact_name}-tf{tf.__version__}{suffix}{extension}"
+
+
+def load_backend(backend, build_model, input_shape, artifact_name, model_cache_folder="model_cache", quantize=False,
+                 threads=None):
+    """Return an object with a predict(batch) method running the model built by build_model.
+
+    For the onnx and tflite backends the Keras model is only built when the converted file is not in the
+    model cache folder yet.
+    """
+    if backend == "keras":
+        return KerasBackend(build_model())
+    if backend not in BACKENDS:
+        exit("Error 7")
+
+    backend_class = OnnxBackend if backend == "onnx" else TFLiteBackend
+    artifact_path = get_artifact_path(model_cache_folder, artifact_name, backend, quantize)
+    if not artifact_path.exists():
+        print(f"Converting model to {artifact_path.name}...")
+        artifact_path.parent.mkdir(parents=True, exist_ok=True)
+        # Convert into a temporary file, so an interrupted conversion or a second process never leaves half a file
+        temporary_path = artifact_path.with_name(f"{artifact_path.stem}-{os.getpid()}{artifact_path.suffix}")
+        backend_class.convert(build_model(), input_shape, temporary_path, quantize)
+        os.replace(temporary_path, artifact_path)
+    return backend_class(artifact_path, threads)
+
+
+def top1_agreement(reference_predictions, predictions):
+    # Share of the images for which both models pick the same best class
+    reference_predictions = np.asarray(reference_predictions)
+    predictions = np.asarray(predictions)
+    return float(np.mean(np.argmax(reference_predictions, axis=1) == np.argmax(predictions, axis=1)))
@@ -1,12 +1,23 @@
 import os
 import logging
 from logging.handlers import RotatingFileHandler
-from PIL import Image
+import PIL
+import numpy as np
 from datetime import datetime, timedelta
 from pathlib import Path
 import hashlib
-import mysql.connector
+import math
+import queue
+import re
+import threading
+from collections import Counter
+import time
+import sqlite3
 import yaml
+from file_hashing import HASH_ALGORITHMS, hash_data
+from image_analysis import ImageContext
+from png_metadata import read_parameters
+from stat_cache import StatCache
 
 
 def read_configuration():
@@ -86,21 +97,7 @@ def configure_loggers():
 
 
 # Function to extract metadata categories and subcategories
-def get_image_metadata(image_path, info_logger):
-    try:
-        with Image.open(image_path) as img:
-            raw_metadata = img.info
-            if raw_metadata is not None:
-                metadata = raw_metadata.get("parameters", "")
-                if metadata is not None:
-                    return metadata
-    except Exception as e:
-        info_logger.error(f"An error occurred: {str(e)}")
-
-
-def extract_metadata_from_parameter(
-    metadata, image_path, nsfw, info_logger, debug_logger
-):
+def extract_metadata_from_parameter(metadata, image_path, digests, debug_logger):
     metadata_dict = {}
 
     # Add filename, directory, and file size to the metadata
@@ -163,83 +160,356 @@ def extract_metadata_from_parameter(
         # If neither "Negative prompt" nor "Steps" is found, consider the entire section as "Positive prompt"
         metadata_dict["PositivePrompt"] = metadata
 
-    # Add NSFW values
-    if nsfw:
-        import opennsfw2 as n2
+    # The NSFW stage adds the NSFW probability when it is enabled, otherwise the column isn't written
+    metadata_dict["NSFWProbability"] = ""
 
-        try:
-            img = Image.open(image_path)
-            img.thumbnail((512, 512))
-
-            nsfw_probability = n2.predict_image(image_path)
-            if nsfw_probability is None:
-                info_logger.error(f"NSFW Probability is None.")
-                return {}
+    # Hash values, computed from the same read by the read stage
+    metadata_dict.update(digests)
 
-            debug_logger.info(
-                f"NSFWProbability for image '{os.path.basename(image_path)}' is {nsfw_probability}"
-            )
-            metadata_dict["NSFWProbability"] = nsfw_probability
-        except OSError as e:
-            debug_logger.warning(
-                f"Skipping image '{os.path.basename(image_path)}' due to an error: {str(e)}"
-            )
-    else:
-        nsfw_probability = ""
-        metadata_dict["NSFWProbability"] = nsfw_probability
-        debug_logger.info("NSFW is off so no nsfw calculation")
+    if metadata_dict is not None:
+        return metadata_dict
 
-    hashermd5 = hashlib.md5()
-    hashersha1 = hashlib.sha1()
-    hashersha256 = hashlib.sha256()
 
-    # Get Hash values
+def read_image(image_path, hashes):
+    # The file is read once: the digests, the header and the NSFW input all come from the same bytes
     with open(image_path, "rb") as file:
+        data = file.read()
+    return data, hash_data(data, hashes), read_parameters(image_path, data)
+
+
+def find_images(image_folder, stat_cache, known_metadata, conn, counts):
+    # (path, stat) of the PNG files in the folder. Files the stat cache knows as unchanged, with a SHA256 in the
+    # table, are left out before they are read; stat is None without a stat cache.
+    for root, dirs, files in os.walk(image_folder):  # Do not delete "dirs"!!!
+        for filename in files:
+            if filename.endswith(".png"):
+                image_path = os.path.join(root, filename)
+                stat = None
+                if stat_cache is not None:
+                    try:
+                        stat = os.stat(image_path)
+                    except OSError:
+                        continue
+                    sha256 = stat_cache.get(image_path, stat)
+                    if sha256 is not None and known_metadata.contains(sha256, conn):
+                        counts["unchanged"] += 1
+                        continue
+                yield image_path, stat
+
+
+class ExtractionPipeline:
+    """Walk -> read/parse/hash -> NSFW -> database, each stage in its own threads connected by bounded queues.
+
+    The walk thread lists the changed images, read_workers threads read the header, hash the file and decode the
+    NSFW input of images that aren't known yet, and the NSFW thread runs a persistent model over batches of
+    nsfw_batch_size images. results() yields the rows in completion order to the thread writing the database,
+    and logs the queue depths every report_interval seconds: the stage in front of the fullest queue is the
+    bottleneck.
+    """
+
+    def __init__(self, image_folder, stat_cache, known_metadata, backend, hashes, nsfw, info_logger, debug_logger,
+                 read_workers=4, nsfw_batch_size=32, queue_depth=256, report_interval=30, batch=None):
+        self.image_folder = image_folder
+        self.stat_cache = stat_cache
+        self.known_metadata = known_metadata
+        self.backend = backend
+        self.hashes = hashes
+        self.nsfw = nsfw
+        self.info_logger = info_logger
+        self.debug_logger = debug_logger
+        self.read_workers = read_workers
+        self.nsfw_batch_size = nsfw_batch_size
+        self.report_interval = report_interval
+        self.batch = batch
+        self.counts = Counter()
+        # Input queue of each stage, the last one feeds the database thread
+        self.queues = {"read": queue.Queue(queue_depth), "nsfw": queue.Queue(queue_depth),
+                       "database": queue.Queue(queue_depth)}
+        self._finished_readers = 0
+        self._lock = threading.Lock()
+
+    def results(self):
+        # Yields (image_path, stat, extracted_metadata)
+        threads = [threading.Thread(target=self._walk, daemon=True),
+                   threading.Thread(target=self._run_nsfw, daemon=True)]
+        threads += [threading.Thread(target=self._read, daemon=True) for _ in range(self.read_workers)]
+        for thread in threads:
+            thread.start()
+
+        last_report = time.monotonic()
         while True:
-            chunk = file.read(4096)  # Read in 4KB chunks
-            if not chunk:
+            try:
+                item = self.queues["database"].get(timeout=1)
+            except queue.Empty:
+                item = False
+            if time.monotonic() - last_report >= self.report_interval:
+                self.report()
+                last_report = time.monotonic()
+            if item is None:
                 break
-            hashermd5.update(chunk)
-            hashersha1.update(chunk)
-            hashersha256.update(chunk)
-
-    hash_md5 = hashermd5.hexdigest()
-    hash_sha1 = hashersha1.hexdigest()
-    hash_sha256 = hashersha256.hexdigest()
-    metadata_dict["MD5"] = hash_md5
-    metadata_dict["SHA1"] = hash_sha1
-    metadata_dict["SHA256"] = hash_sha256
+            if item is not False:
+                yield item
+        for thread in threads:
+            thread.join()
+        self.report()
+
+    def report(self):
+        depths = ", ".join(f"{name} {stage_queue.qsize()}/{stage_queue.maxsize}"
+                           for name, stage_queue in self.queues.items())
+        if self.batch is not None:
+            depths += f", writers {self.batch.queued_batches()}/{self.batch.queue_depth} batches"
+        counts = ", ".join(f"{count} {name}" for name, count in sorted(self.counts.items()))
+        self.info_logger.info(f"Queue depths: {depths}. Images: {counts or 'none'}.")
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _walk(self):
+        conn = self.backend.connect()
+        try:
+            for image_path, stat in find_images(self.image_folder, self.stat_cache, self.known_metadata, conn,
+                                                self.counts):
+                self.debug_logger.debug(f"Found image file: {image_path}")
+                self.queues["read"].put((image_path, stat))
+                self._count("found")
+        except Exception as e:
+            self.info_logger.error(f"Walking {self.image_folder} failed: {e}")
+        finally:
+            conn.close()
+            # One end marker per reader
+            for _ in range(self.read_workers):
+                self.queues["read"].put(None)
 
-    if metadata_dict is not None:
-        return metadata_dict
+    def _read(self):
+        while True:
+            item = self.queues["read"].get()
+            if item is None:
+                break
+            image_path, stat = item
+            try:
+                self._read_image(image_path, stat)
+            except Exception as e:
+                self.info_logger.error(f"Skipping image '{image_path}' due to an error: {str(e)}")
+                self._count("failed")
+        # The last reader passes the end on
+        with self._lock:
+            self._finished_readers += 1
+            last = self._finished_readers == self.read_workers
+        if last:
+            self.queues["nsfw"].put(None)
+
+    def _read_image(self, image_path, stat):
+        # The pixels are decoded for the NSFW input only
+        data, digests, metadata = read_image(image_path, self.hashes)
+        extracted_metadata = extract_metadata_from_parameter(metadata, image_path, digests, self.debug_logger)
+        self.debug_logger.info(f"Extracted metadata from {image_path} is {extracted_metadata}")
+
+        # Known images look up their stored probability in the NSFW stage instead of being decoded
+        context = None
+        if self.nsfw and not self.known_metadata.might_contain(digests["SHA256"]):
+            context = ImageContext(Path(image_path), data)
+            try:
+                context.nsfw_input()
+                # Only the NSFW input waits in the queue
+                context.release()
+            except (PIL.UnidentifiedImageError, OSError) as e:
+                self.debug_logger.warning(f"Skipping NSFW of image '{os.path.basename(image_path)}': {str(e)}")
+                context = None
+        self.queues["nsfw"].put((image_path, stat, extracted_metadata, context))
+        self._count("read")
+
+    def _run_nsfw(self):
+        conn = None
+        model = None
+        pending = []
+        item = False
+        try:
+            conn = self.backend.connect() if self.nsfw else None
+            while True:
+                # A partial batch is run when no image arrives for a second
+                try:
+                    item = self.queues["nsfw"].get(timeout=1 if pending else None)
+                except queue.Empty:
+                    item = False
+                if item is False or item is None or len(pending) >= self.nsfw_batch_size:
+                    if pending:
+                        model = self._predict_batch(model, pending)
+                        pending = []
+                if item is None:
+                    break
+                if item is False:
+                    continue
+
+                image_path, stat, extracted_metadata, context = item
+                if self.nsfw and context is None:
+                    try:
+                        known_nsfw_probability = self.known_metadata.get_nsfw_probability(
+                            extracted_metadata["SHA256"], conn
+                        )
+                    except Exception as e:
+                        self.info_logger.error(f"Skipping image '{image_path}' due to an error: {str(e)}")
+                        self._count("failed")
+                        continue
+                    if known_nsfw_probability is not None:
+                        extracted_metadata["NSFWProbability"] = known_nsfw_probability
+                        self._count("known nsfw")
+                    else:
+                        # A false positive of the known hashes or a row without a probability
+                        context = ImageContext(Path(image_path))
+                if context is not None:
+                    pending.append((image_path, stat, extracted_metadata, context))
+                else:
+                    self.queues["database"].put((image_path, stat, extracted_metadata))
+        except Exception as e:
+            self.info_logger.error(f"NSFW stage failed, skipping the remaining images. Error: {str(e)}")
+            for _ in pending:
+                self._count("failed")
+            # Take the remaining images off the queue, so the readers don't block on it
+            while item is not None:
+                item = self.queues["nsfw"].get()
+                if item is not None:
+                    self._count("failed")
+        finally:
+            # The database thread always gets its end marker, even when this stage failed
+            try:
+                if conn is not None:
+                    conn.close()
+            finally:
+                self.queues["database"].put(None)
 
+    def _predict_batch(self, model, pending):
+        # Returns the model, loaded on first use. A failed batch is left out of the database, so its images are
+        # read again by the next run instead of being stored without their probability.
+        try:
+            if model is None:
+                import opennsfw2 as n2
+                self.info_logger.info("Loading NSFW model...")
+                model = n2.make_open_nsfw_model()
+            self._predict(model, pending)
+        except Exception as e:
+            self.info_logger.error(f"NSFW batch of {len(pending)} images failed, skipping them. Error: {str(e)}")
+            for _ in pending:
+                self._count("failed")
+        return model
+
+    def _predict(self, model, pending):
+        inputs = []
+        predicted = []
+        for image_path, stat, extracted_metadata, context in pending:
+            try:
+                inputs.append(context.nsfw_input())
+                predicted.append(extracted_metadata)
+            except (PIL.UnidentifiedImageError, OSError) as e:
+                self.debug_logger.warning(f"Skipping NSFW of image '{os.path.basename(image_path)}': {str(e)}")
+        if inputs:
+            predictions = model.predict(np.stack(inputs), batch_size=len(inputs), verbose=0)
+            for prediction, extracted_metadata in zip(predictions, predicted):
+                extracted_metadata["NSFWProbability"] = float(prediction[1])
+                self._count("nsfw")
+        for image_path, stat, extracted_metadata, context in pending:
+            self.queues["database"].put((image_path, stat, extracted_metadata))
+
+
+# Function to connect to the MySQL database, one pooled connection per writer plus one for the reads
+def connect_database(host, user, password, database_name, info_logger, pool_size=1):
+    import mysql.connector.pooling
 
-# Function to create a MySQL database and table
-def connect_database(host, user, password, database_name, info_logger):
     try:
-        conn = mysql.connector.connect(
-            host=host, user=user, password=password, database=database_name
+        pool = mysql.connector.pooling.MySQLConnectionPool(
+            pool_name="metadata_extraction",
+            pool_size=pool_size,
+            host=host,
+            user=user,
+            password=password,
+            database=database_name,
         )
-        if conn is not None:
-            info_logger.debug(f"Connected to MySQL database: {database_name}")
-            return conn
-        else:
-            info_logger.error("Failed to connect to the database")
+        info_logger.debug(f"Connected to MySQL database: {database_name} ({pool_size} connections)")
+        return pool
     except mysql.connector.Error as e:
         info_logger.error(f"Failed to connect to the database: {e}")
 
 
+# Column types of the metadata table, text columns that are indexed or compared have a fixed length
+COLUMN_TYPES = {
+    "FileName": "VARCHAR(255)",
+    "Directory": "VARCHAR(255)",
+    "FileSize": "BIGINT",
+    "CreatedAt": "DATETIME",
+    "PositivePrompt": "TEXT",
+    "NegativePrompt": "TEXT",
+    "Steps": "INT",
+    "Sampler": "VARCHAR(64)",
+    "CFGScale": "DOUBLE",
+    "Seed": "BIGINT",
+    "ImageSize": "VARCHAR(32)",
+    "ModelHash": "VARCHAR(64)",
+    "Model": "VARCHAR(255)",
+    "SeedResizeFrom": "VARCHAR(32)",
+    "DenoisingStrength": "DOUBLE",
+    "Version": "VARCHAR(64)",
+    "NSFWProbability": "DOUBLE",
+    "MD5": "CHAR(32)",
+    "SHA1": "CHAR(40)",
+    "SHA256": "CHAR(64)",
+}
+
+# Secondary indexes by name, the SHA256 gets a unique key
+INDEXES = {
+    "idx_model": "Model",
+    "idx_created_at": "CreatedAt",
+}
+
+# Names of the generation parameters that differ from their column
+PARAMETER_COLUMNS = {
+    "CFG scale": "CFGScale",
+    "Size": "ImageSize",
+    "Model hash": "ModelHash",
+    "Seed resize from": "SeedResizeFrom",
+    "Denoising strength": "DenoisingStrength",
+}
+
+
+def get_row_values(metadata, columns):
+    # Values in the types of the columns, empty and unparsable values become NULL
+    aliases = {column: name for name, column in PARAMETER_COLUMNS.items()}
+    values = []
+    for column in columns:
+        value = metadata.get(column, metadata.get(aliases.get(column), ""))
+        column_type = COLUMN_TYPES.get(column, "TEXT")
+        try:
+            if value == "" or value is None:
+                value = None
+            elif column_type in ["INT", "BIGINT"]:
+                value = int(value)
+            elif column_type == "DOUBLE":
+                value = float(value)
+            elif column_type == "DATETIME":
+                value = datetime.strptime(str(value), "%Y-%m-%d %H:%M:%S")
+            else:
+                value = str(value)
+        except ValueError:
+            value = None
+        values.append(value)
+    return values
+
+
 def update_database_table(conn, table_name, columns, info_logger):
+    import mysql.connector
+
     cursor = conn.cursor()
     cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
-    table_exists = cursor.fetchone()[0]
+    table_exists = cursor.fetchone()
     if table_exists is None:
         # Create the table if it doesn't exist
-        column_definitions = ", ".join([f"{column} TEXT" for column in columns])
+        column_definitions = ", ".join([f"{column} {COLUMN_TYPES.get(column, 'TEXT')}" for column in columns])
+        index_definitions = ", ".join([f"INDEX {name} ({column})" for name, column in INDEXES.items()])
         create_table_query = f"""
         CREATE TABLE {table_name} (
             id INT AUTO_INCREMENT PRIMARY KEY,
-            {column_definitions}
+            {column_definitions},
+            UNIQUE KEY uq_sha256 (SHA256),
+            {index_definitions}
         )
         """
 
@@ -249,11 +519,12 @@ def update_database_table(conn, table_name, columns, info_logger):
             info_logger.info(f"Table {table_name} created successfully.")
         except mysql.connector.Error as e:
             info_logger.error(f"Table creation could not be executed: {e}")
-        finally:
-            cursor.close()
+    cursor.close()
 
 
 def update_database_columns(conn, table_name, columns, info_logger):
+    import mysql.connector
+
     # Check and add columns if they do not exist
     cursor = conn.cursor()
 
@@ -263,27 +534,165 @@ def update_database_columns(conn, table_name, columns, info_logger):
     for column in columns:
         if column not in existing_columns:
             # Add the column if it does not exist
-            add_column_query = f"ALTER TABLE {table_name} ADD COLUMN {column} TEXT"
+            add_column_query = f"ALTER TABLE {table_name} ADD COLUMN {column} {COLUMN_TYPES.get(column, 'TEXT')}"
             try:
                 cursor.execute(add_column_query)
                 conn.commit()
                 info_logger.info(f"Column {column} added successfully.")
             except mysql.connector.Error as e:
                 info_logger.error(f"Error adding column {column}: {e}")
-            finally:
-                cursor.close()
+    cursor.close()
+
+
+def migrate_database_table(conn, table_name, columns, info_logger):
+    # Converts a table created with TEXT columns to the column types, removes duplicate SHA256 rows and adds
+    # the unique key and the indexes. Tables that are up to date are left alone.
+    import mysql.connector
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DESCRIBE {table_name}")
+        existing_types = {}
+        for row in cursor.fetchall():
+            column_type = row[1].decode() if isinstance(row[1], bytes) else row[1]
+            # Older servers report integer types with a display width, e.g. int(11)
+            existing_types[row[0]] = re.sub(r"INT\(\d+\)", "INT", column_type.upper()).replace(" ", "")
+        cursor.execute(f"SHOW INDEX FROM {table_name}")
+        existing_indexes = {row[2] for row in cursor.fetchall()}
+
+        changed_columns = [column for column in columns if existing_types.get(column) != COLUMN_TYPES[column]]
+        missing_indexes = {name: column for name, column in INDEXES.items() if name not in existing_indexes}
+        if not changed_columns and not missing_indexes and "uq_sha256" in existing_indexes:
+            return
+
+        info_logger.info(f"Migrating table {table_name}, this may take a while for large tables.")
+        for column in changed_columns:
+            # Values that can't be converted would abort the ALTER TABLE in strict mode
+            column_type = COLUMN_TYPES[column]
+            if column_type in ["INT", "BIGINT"]:
+                cursor.execute(f"UPDATE {table_name} SET {column} = NULL WHERE {column} NOT REGEXP '^-?[0-9]+$'")
+            elif column_type == "DOUBLE":
+                cursor.execute(
+                    f"UPDATE {table_name} SET {column} = NULL "
+                    f"WHERE {column} NOT REGEXP '^-?[0-9]+([.][0-9]+)?([eE][-+]?[0-9]+)?$'"
+                )
+            elif column_type == "DATETIME":
+                cursor.execute(f"UPDATE {table_name} SET {column} = NULL WHERE STR_TO_DATE({column}, "
+                               f"'%Y-%m-%d %H:%i:%s') IS NULL")
+            elif column_type.startswith(("VARCHAR", "CHAR")):
+                length = int(column_type[column_type.index("(") + 1:-1])
+                cursor.execute(f"UPDATE {table_name} SET {column} = LEFT({column}, {length})")
+        if "uq_sha256" not in existing_indexes:
+            # Keep the oldest row of every SHA256
+            cursor.execute(f"""
+                DELETE newer FROM {table_name} newer
+                JOIN {table_name} older ON newer.SHA256 = older.SHA256 AND newer.id > older.id
+            """)
+            info_logger.info(f"Removed {cursor.rowcount} rows with a duplicate SHA256.")
+        conn.commit()
+
+        # One ALTER TABLE, so the table is only rebuilt once
+        alterations = [f"MODIFY {column} {COLUMN_TYPES[column]}" for column in changed_columns]
+        if "uq_sha256" not in existing_indexes:
+            alterations.append("ADD UNIQUE KEY uq_sha256 (SHA256)")
+        alterations += [f"ADD INDEX {name} ({column})" for name, column in missing_indexes.items()]
+        cursor.execute(f"ALTER TABLE {table_name} {', '.join(alterations)}")
+        conn.commit()
+        info_logger.info(f"Table {table_name} migrated: {', '.join(alterations)}.")
+    except mysql.connector.Error as e:
+        conn.rollback()
+        info_logger.error(f"Migration of table {table_name} failed: {e}")
+    finally:
+        cursor.close()
+
+
+# Storage backends of the metadata table, selected with "backend" in metadata_config.yml
+BACKENDS = ["mysql", "sqlite"]
+
+
+class MySQLBackend:
+    placeholder = "%s"
+
+    def __init__(self, config, pool_size, info_logger):
+        import mysql.connector
+
+        # Connection errors after which the connection is reconnected and the batch retried
+        self.connection_errors = (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)
+        self.pool = connect_database(
+            config["host"], config["user"], config["password"], config["database_name"], info_logger, pool_size
+        )
+
+    def connect(self):
+        return self.pool.get_connection()
+
+    def prepare_table(self, conn, table_name, columns, info_logger):
+        update_database_table(conn, table_name, columns, info_logger)
+        update_database_columns(conn, table_name, columns, info_logger)
+        # Convert tables of older versions to the column types and add the unique key and the indexes
+        migrate_database_table(conn, table_name, columns, info_logger)
+
+    def upsert_clause(self, columns):
+        return "ON DUPLICATE KEY UPDATE " + ", ".join([f"{column} = VALUES({column})" for column in columns])
+
+    def reconnect(self, conn):
+        conn.reconnect(attempts=3, delay=1)
+
+
+class SQLiteBackend:
+    """The metadata table in a local SQLite file, with the schema and upsert of the MySQL table.
+
+    WAL lets the main thread read while the writer commits. SQLite takes one writer at a time.
+    """
+
+    placeholder = "?"
+    # The database is locked by another process, the write is retried
+    connection_errors = (sqlite3.OperationalError,)
+
+    def __init__(self, config, pool_size, info_logger):
+        self.path = config.get("sqlite_path") or "metadata.sqlite"
+        # Same text format as MySQL, the row fingerprints compare the values as text
+        sqlite3.register_adapter(datetime, lambda value: value.strftime("%Y-%m-%d %H:%M:%S"))
+        info_logger.debug(f"Using SQLite database: {self.path}")
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL a commit survives a crash of the process, only a power loss may drop the last transactions
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def prepare_table(self, conn, table_name, columns, info_logger):
+        # SQLite accepts the MySQL type names and gives the columns the matching affinity
+        column_definitions = ", ".join([f"{column} {COLUMN_TYPES.get(column, 'TEXT')}" for column in columns])
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table_name} (id INTEGER PRIMARY KEY, {column_definitions})")
+        existing_columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+        for column in columns:
+            if column not in existing_columns:
+                conn.execute(f"ALTER TABLE {table_name} ADD COLUMN {column} {COLUMN_TYPES.get(column, 'TEXT')}")
+                info_logger.info(f"Column {column} added successfully.")
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_sha256 ON {table_name} (SHA256)")
+        for name, column in INDEXES.items():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table_name} ({column})")
+        conn.commit()
+
+    def upsert_clause(self, columns):
+        return "ON CONFLICT (SHA256) DO UPDATE SET " + ", ".join([f"{column} = excluded.{column}" for column in columns])
 
+    def reconnect(self, conn):
+        time.sleep(1)
 
-def check_if_metadata_exists(conn, metadata, table_name, debug_logger):
+
+def check_if_metadata_exists(conn, metadata, table_name, debug_logger, placeholder="%s"):
     cursor = conn.cursor()
 
-    # Check if the data already exists in the database
+    # Check if the data already exists in the database, a lookup in the unique key
     query = f"""
     SELECT COUNT(*) FROM {table_name}
-    WHERE SHA256 = %s
+    WHERE SHA256 = {placeholder}
     """
     cursor.execute(query, (metadata.get("SHA256", ""),))
     row_count = cursor.fetchone()[0]
+    cursor.close()
     if row_count:
         debug_logger.info(f"Number of rows with the same SHA256 value: {row_count}")
     else:
@@ -294,7 +703,7 @@ def check_if_metadata_exists(conn, metadata, table_name, debug_logger):
 
 
 def check_if_metadata_equal(
-    conn, metadata, table_name, columns, info_logger, debug_logger
+    conn, metadata, table_name, columns, info_logger, debug_logger, placeholder="%s"
 ):
     cursor = conn.cursor()
 
@@ -303,7 +712,7 @@ def check_if_metadata_equal(
     query = f"""
         SELECT {select_columns}
         FROM {table_name}
-        WHERE SHA256 = %s
+        WHERE SHA256 = {placeholder}
     """
 
     try:
@@ -311,22 +720,15 @@ def check_if_metadata_equal(
         result = cursor.fetchone()
 
         if result:
-            existing_metadata = {columns[i]: result[i] for i in range(len(columns))}
-
-            # Check if the metadata is equal
-            equal_values = all(
-                metadata[key] == str(existing_metadata[key]) for key in columns
-            )
-
-            if equal_values:
+            # Compare the values in the types of the columns
+            values = get_row_values(metadata, columns)
+            if get_fingerprint(values) == get_fingerprint(result):
                 debug_logger.info("Metadata is already in the database and is equal.")
                 return True
             else:
                 debug_logger.info("Metadata in the database is different. Comparison:")
-                for column in columns:
-                    debug_logger.info(
-                        f"{column} : {metadata.get(column, 'N/A')}  |  {column} : {existing_metadata.get(column, 'N/A')}"
-                    )
+                for column, value, existing_value in zip(columns, values, result):
+                    debug_logger.info(f"{column} : {value}  |  {column} : {existing_value}")
 
                 return False
         else:
@@ -338,69 +740,327 @@ def check_if_metadata_equal(
         cursor.close()
 
 
-# Function to insert metadata into the MySQL database if it doesn't already exist
-def insert_metadata_into_database(
-    conn, metadata, table_name, columns, info_logger, extraction_logger
-):
+# Share of new images the Bloom filter lets through to a confirmation query
+BLOOM_ERROR_RATE = 0.001
+
+
+def get_fingerprint(values):
+    # Short digest of a row as it is stored in the TEXT columns, to compare rows without keeping them in memory
+    text = "\x1f".join("" if value is None else str(value) for value in values)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(round(self.size / capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, sha256):
+        # The SHA256 is already uniform, two of its 64 bit words give all positions (double hashing)
+        digest = bytes.fromhex(sha256)
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:16], "little") | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, sha256):
+        for position in self._positions(sha256):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, sha256):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(sha256))
+
+
+class KnownMetadata:
+    """SHA256 values and row fingerprints of the table, loaded once so the existence checks are local lookups.
+
+    The stored NSFW probabilities are loaded with them, so known images reuse theirs without a query. With
+    use_bloom only a Bloom filter of the SHA256 values is kept: images it doesn't contain are new, the others
+    are confirmed with the database queries.
+    """
+
+    def __init__(self, conn, table_name, columns, info_logger, debug_logger, use_bloom=False, placeholder="%s"):
+        self.conn = conn
+        self.placeholder = placeholder
+        self.table_name = table_name
+        self.columns = columns
+        self.info_logger = info_logger
+        self.debug_logger = debug_logger
+        self.use_bloom = use_bloom
+        self.fingerprints = {}
+        # Stored NSFW probability by SHA256, rows without one are left out
+        self.nsfw_probabilities = {}
+        self.duplicates = set()
+
+        cursor = conn.cursor()
+        try:
+            if use_bloom:
+                cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+                self.bloom = BloomFilter(cursor.fetchone()[0] * 2)
+                cursor.execute(f"SELECT SHA256 FROM {table_name}")
+                for (sha256,) in cursor:
+                    if sha256:
+                        self.bloom.add(sha256)
+            else:
+                cursor.execute(f"SELECT {', '.join(columns)} FROM {table_name}")
+                sha256_index = columns.index("SHA256")
+                # Not selected when the NSFW stage is disabled
+                nsfw_index = columns.index("NSFWProbability") if "NSFWProbability" in columns else None
+                for row in cursor:
+                    if not row[sha256_index]:
+                        continue
+                    key = bytes.fromhex(row[sha256_index])
+                    if key in self.fingerprints:
+                        self.duplicates.add(key)
+                    self.fingerprints[key] = get_fingerprint(row)
+                    if nsfw_index is not None and row[nsfw_index] is not None:
+                        self.nsfw_probabilities[key] = row[nsfw_index]
+        finally:
+            cursor.close()
+        info_logger.info(f"Loaded the known SHA256 values of {table_name} ({'bloom filter' if use_bloom else 'memory'}).")
+
+    def row_count(self, metadata):
+        sha256 = metadata.get("SHA256", "")
+        if self.use_bloom:
+            if sha256 not in self.bloom:
+                return 0
+            return check_if_metadata_exists(self.conn, metadata, self.table_name, self.debug_logger, self.placeholder)
+        key = bytes.fromhex(sha256)
+        if key in self.duplicates:
+            return 2
+        return 1 if key in self.fingerprints else 0
+
+    def is_equal(self, metadata):
+        if self.use_bloom:
+            return check_if_metadata_equal(
+                self.conn, metadata, self.table_name, self.columns, self.info_logger, self.debug_logger,
+                self.placeholder,
+            )
+        fingerprint = get_fingerprint(get_row_values(metadata, self.columns))
+        return self.fingerprints[bytes.fromhex(metadata.get("SHA256", ""))] == fingerprint
+
+    def might_contain(self, sha256):
+        # Without a database query, so true for the false positives of the Bloom filter
+        if self.use_bloom:
+            return sha256 in self.bloom
+        return bytes.fromhex(sha256) in self.fingerprints
+
+    def contains(self, sha256, conn=None):
+        # Other threads pass their own connection
+        if self.use_bloom:
+            return sha256 in self.bloom and check_if_metadata_exists(
+                conn or self.conn, {"SHA256": sha256}, self.table_name, self.debug_logger, self.placeholder
+            ) > 0
+        return bytes.fromhex(sha256) in self.fingerprints
+
+    def get_nsfw_probability(self, sha256, conn=None):
+        # Stored NSFW probability of a known image, None for new images and rows without one
+        if not self.use_bloom:
+            return self.nsfw_probabilities.get(bytes.fromhex(sha256))
+        if not self.might_contain(sha256):
+            return None
+        cursor = (conn or self.conn).cursor()
+        try:
+            cursor.execute(f"SELECT NSFWProbability FROM {self.table_name} WHERE SHA256 = {self.placeholder}", (sha256,))
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        return row[0] if row is not None else None
+
+    def add(self, metadata):
+        # Called for every row queued for writing, so later images with the same hash see it
+        if self.use_bloom:
+            self.bloom.add(metadata.get("SHA256", ""))
+        else:
+            values = get_row_values(metadata, self.columns)
+            key = bytes.fromhex(metadata.get("SHA256", ""))
+            self.fingerprints[key] = get_fingerprint(values)
+            if "NSFWProbability" in self.columns:
+                nsfw_probability = values[self.columns.index("NSFWProbability")]
+                if nsfw_probability is not None:
+                    self.nsfw_probabilities[key] = nsfw_probability
+                else:
+                    self.nsfw_probabilities.pop(key, None)
+
+
+# Function to write a batch of metadata rows into the MySQL database in one transaction
+def upsert_metadata_into_database(backend, conn, rows, table_name, columns):
     cursor = conn.cursor()
 
     column_names = ", ".join(columns)
-    value_placeholders = ", ".join(["%s" for _ in columns])
+    value_placeholders = ", ".join([backend.placeholder for _ in columns])
     try:
-        # Build and execute the SQL query
+        # executemany sends the rows as one multi-row INSERT, rows with a known SHA256 are updated in place
         query = f"""
             INSERT INTO {table_name} ({column_names})
             VALUES ({value_placeholders})
+            {backend.upsert_clause(columns)}
         """
-
-        # Extract values from metadata based on column order
-        values = [metadata.get(column, "") for column in columns]
-
-        cursor.execute(query, values)
+        cursor.executemany(query, [get_row_values(metadata, columns) for metadata in rows])
         conn.commit()
-        extraction_logger.info(
-            f"Metadata from {metadata.get('File Name', '')} in folder {metadata.get('Directory', '')} extracted and added to the database."
-        )
-    except Exception as e:
-        info_logger.error(
-            f"Error while inserting metadata into database from {metadata.get('File Name', '')} in folder {metadata.get('Directory', '')}. Error: {e}"
-        )
     finally:
         cursor.close()
 
 
-def update_metadata_in_database(
-    conn, metadata, table_name, columns, info_logger, extraction_logger
-):
-    cursor = conn.cursor()
+class MetadataBatch:
+    """Buffers extracted rows and hands them to the writer workers every batch_size rows or flush_interval seconds.
 
-    # Build the SET clause for updating
-    set_clause = ", ".join([f"{column} = %s" for column in columns])
+    Each writer has its own pooled connection and writes a batch with one upsert in one transaction, while the
+    main thread keeps extracting. When queue_depth batches are waiting, flush() blocks until a writer catches
+    up. A lost connection is reconnected and the batch retried; a batch that fails otherwise is rolled back and
+    its rows are written one by one, so a single bad row only loses itself. The counters only include
+    committed rows. When a writer can't write at all, e.g. the database stays unreachable, the writers drop the
+    remaining batches and the next flush(), wait() or close() in the main thread raises the error.
+    """
 
-    try:
-        # Build and execute the SQL query
-        query = f"""
-            UPDATE {table_name}
-            SET {set_clause}
-            WHERE SHA256 = %s
-        """
+    def __init__(self, backend, table_name, columns, info_logger, extraction_logger, batch_size=500, flush_interval=5,
+                 writers=2, queue_depth=4):
+        self.backend = backend
+        self.table_name = table_name
+        self.columns = columns
+        self.info_logger = info_logger
+        self.extraction_logger = extraction_logger
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # (metadata, is_update) per row not handed to the writers yet
+        self.rows = []
+        # SHA256 of every row that isn't committed yet
+        self.pending_hashes = set()
+        self.inserted_count = 0
+        self.updated_count = 0
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        # First error a writer couldn't recover from
+        self.error = None
+        self.queue_depth = queue_depth
+        self._batches = queue.Queue(maxsize=queue_depth)
+        self._writers = [threading.Thread(target=self._run_writer, args=(backend.connect(),), daemon=True)
+                         for _ in range(writers)]
+        for writer in self._writers:
+            writer.start()
+
+    def is_pending(self, sha256):
+        # Rows not committed yet are invisible to the existence checks
+        with self._lock:
+            return sha256 in self.pending_hashes
+
+    def insert(self, metadata):
+        self._add(metadata, False)
+
+    def update(self, metadata):
+        self._add(metadata, True)
+
+    def _add(self, metadata, is_update):
+        self.rows.append((metadata, is_update))
+        with self._lock:
+            self.pending_hashes.add(metadata.get("SHA256"))
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        # Also called for unchanged images, so a slow stretch of them doesn't hold back the pending rows
+        if len(self.rows) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._raise_error()
+        rows, self.rows = self.rows, []
+        self._last_flush = time.monotonic()
+        if rows:
+            self._batches.put(rows)
+
+    def queued_batches(self):
+        return self._batches.qsize()
+
+    def wait(self):
+        # Returns once every row so far is committed
+        self.flush()
+        self._batches.join()
+        self._raise_error()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            for _ in self._writers:
+                self._batches.put(None)
+            for writer in self._writers:
+                writer.join()
 
-        # Extract values from metadata based on column order
-        values = [metadata.get(column, "") for column in columns]
-        values.append(metadata.get("SHA256", ""))  # Append SHA256 for WHERE condition
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError(f"Writing the metadata to the database failed: {self.error}") from self.error
 
-        cursor.execute(query, values)
-        conn.commit()
+    def _run_writer(self, conn):
+        while True:
+            rows = self._batches.get()
+            if rows is None:
+                conn.close()
+                self._batches.task_done()
+                return
+            try:
+                if self.error is None:
+                    self._write(conn, rows)
+            except Exception as e:
+                self.info_logger.error(f"Writing a batch of {len(rows)} rows failed, stopping the writers. Error: {e}")
+                with self._lock:
+                    if self.error is None:
+                        self.error = e
+            finally:
+                with self._lock:
+                    self.pending_hashes -= {metadata.get("SHA256") for metadata, _ in rows}
+                self._batches.task_done()
 
-        extraction_logger.info(
-            f"Metadata for {metadata.get('File Name', '')} in folder {metadata.get('Directory', '')} has been updated in the database."
-        )
-    except Exception as e:
-        info_logger.error(
-            f"Failed to update metadata for {metadata.get('File Name', '')} in folder {metadata.get('Directory', '')} in the database. Error: {e}"
-        )
-    finally:
-        cursor.close()
+    def _upsert(self, conn, rows, attempts=3):
+        for attempt in range(attempts):
+            try:
+                upsert_metadata_into_database(self.backend, conn, rows, self.table_name, self.columns)
+                return
+            except self.backend.connection_errors as e:
+                # The connection was lost, e.g. the server restarted or closed an idle connection
+                if attempt == attempts - 1:
+                    raise
+                self.info_logger.warning(f"Lost the database connection, reconnecting. Error: {e}")
+                self.backend.reconnect(conn)
+
+    def _rollback(self, conn):
+        # A lost connection can't be rolled back, it is reconnected instead
+        try:
+            conn.rollback()
+        except Exception as e:
+            self.info_logger.warning(f"Rollback failed, reconnecting. Error: {e}")
+            self.backend.reconnect(conn)
+
+    def _write(self, conn, rows):
+        # Connection errors that remain after the retries are raised, _run_writer stops the writers then
+        try:
+            self._upsert(conn, [metadata for metadata, _ in rows])
+            committed = rows
+        except self.backend.connection_errors:
+            raise
+        except Exception as e:
+            self._rollback(conn)
+            self.info_logger.error(f"Batch of {len(rows)} rows failed, writing them one by one. Error: {e}")
+            committed = []
+            for metadata, is_update in rows:
+                try:
+                    self._upsert(conn, [metadata])
+                    committed.append((metadata, is_update))
+                except self.backend.connection_errors:
+                    raise
+                except Exception as e:
+                    self._rollback(conn)
+                    self.info_logger.error(
+                        f"Error while writing metadata from {metadata.get('FileName', '')} in folder {metadata.get('Directory', '')} to the database. Error: {e}"
+                    )
+
+        for metadata, is_update in committed:
+            self.extraction_logger.info(
+                f"Metadata from {metadata.get('FileName', '')} in folder {metadata.get('Directory', '')} extracted and {'updated in' if is_update else 'added to'} the database."
+            )
+        with self._lock:
+            self.updated_count += sum(1 for _, is_update in committed if is_update)
+            self.inserted_count += sum(1 for _, is_update in committed if not is_update)
 
 
 def start_metadata_extractor():
@@ -411,17 +1071,45 @@ def start_metadata_extractor():
         try:
             info_logger.info("Script started.")
             config = read_configuration()
-            host = config["host"]
-            user = config["user"]
-            password = config["password"]
-            database_name = config["database_name"]
+            # "mysql" or "sqlite", the MySQL connection settings are only needed for MySQL
+            backend_name = config.get("backend") or "mysql"
+            if backend_name not in BACKENDS:
+                raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+            if backend_name == "mysql":
+                database = f"{config['user']}@{config['host']}/{config['database_name']}"
+            else:
+                database = config.get("sqlite_path") or "metadata.sqlite"
             table_name = config["table_name"]
             image_folder = Path(config["image_folder"])
             use_yesterday = config.get("use_yesterday", False)
             nsfw = config.get("nsfw_probability", True)
+            # Rows are written every batch_size rows or flush_interval seconds, whichever comes first
+            batch_size = config.get("batch_size") or 500
+            flush_interval = config.get("flush_interval") or 5
+            # "memory" keeps every SHA256 with a row fingerprint, "bloom" a Bloom filter for very large tables
+            known_hashes = config.get("known_hashes") or "memory"
+            # Threads writing the batches, and the number of batches that may wait for them
+            writers = config.get("writers") or 2
+            if backend_name == "sqlite":
+                # SQLite takes one writer at a time, more writers would only wait for the lock
+                writers = 1
+            writer_queue_depth = config.get("writer_queue_depth") or 4
+            # Digests to compute, the SHA256 identifies the images and is always needed
+            hashes = config.get("hashes") or list(HASH_ALGORITHMS)
+            # Threads reading, parsing and hashing the images, images per NSFW batch, and images that may wait
+            # in front of each stage
+            read_workers = config.get("read_workers") or 4
+            nsfw_batch_size = config.get("nsfw_batch_size") or 32
+            queue_depth = config.get("queue_depth") or 256
+            # Seconds between two reports of the queue depths
+            report_interval = config.get("report_interval") or 30
+            # SQLite file with the SHA256 of every file by its stat, unchanged files are skipped without reading
+            stat_cache_path = config.get("stat_cache")
+            if "SHA256" not in hashes or any(name not in HASH_ALGORITHMS for name in hashes):
+                raise ValueError(f"hashes must contain SHA256 and only {', '.join(HASH_ALGORITHMS)}")
 
             info_logger.info(
-                f"Host: {host}, User: {user}, Password: {password}, Database: {database_name}, Table: {table_name}, Image Folder: {image_folder}, Use Yesterday: {use_yesterday}, NSFW: {nsfw}"
+                f"Backend: {backend_name}, Database: {database}, Table: {table_name}, Image Folder: {image_folder}, Use Yesterday: {use_yesterday}, NSFW: {nsfw}, Batch Size: {batch_size}, Flush Interval: {flush_interval}, Known Hashes: {known_hashes}, Writers: {writers}, Hashes: {hashes}, Read Workers: {read_workers}, Stat Cache: {stat_cache_path}"
             )
         except (KeyError, ValueError) as e:
             raise ValueError(f"Invalid configuration: {str(e)}")
@@ -432,118 +1120,85 @@ def start_metadata_extractor():
             formatted_yesterday = yesterday.strftime("%Y-%m-%d")
             image_folder = os.path.join(image_folder, formatted_yesterday)
 
-        columns = [
-            "FileName",
-            "Directory",
-            "FileSize",
-            "CreatedAt",
-            "PositivePrompt",
-            "NegativePrompt",
-            "Steps",
-            "Sampler",
-            "CFGScale",
-            "Seed",
-            "ImageSize",
-            "ModelHash",
-            "Model",
-            "SeedResizeFrom",
-            "DenoisingStrength",
-            "Version",
-            "NSFWProbability",
-            "MD5",
-            "SHA1",
-            "SHA256",
-        ]
-
-        # Create a MySQL database and table if it doesn't exist
-        conn = connect_database(host, user, password, database_name, info_logger)
-
-        # Update the database table and columns
-        update_database_table(conn, table_name, columns, info_logger)
+        # Columns in table order, the compared and written columns leave out the digests that aren't computed, and
+        # the NSFW probability without the NSFW stage so the stored one is kept
+        table_columns = list(COLUMN_TYPES)
+        columns = [column for column in table_columns
+                   if (column not in HASH_ALGORITHMS or column in hashes) and (column != "NSFWProbability" or nsfw)]
 
-        # Update the database columns
-        update_database_columns(conn, table_name, columns, info_logger)
+        # Connect to the database
+        backend_class = MySQLBackend if backend_name == "mysql" else SQLiteBackend
+        # Connections: the writers, this thread, and the walk and NSFW stages
+        backend = backend_class(config, writers + 3, info_logger)
+        conn = backend.connect()
 
-        inserted_count = 0
-        updated_count = 0
-        # Loop through the images in the folder
-        for root, dirs, files in os.walk(image_folder):  # Do not delete "dirs"!!!
-            for filename in files:
-                if filename.endswith(".png"):
-                    image_path = os.path.join(root, filename)
-                    debug_logger.debug(f"Found image file: {image_path}")
-                    metadata = get_image_metadata(image_path, info_logger)
-                    debug_logger.debug(f"Got metadata from image file: {image_path}")
-
-                    # Extract metadata from parameter
-                    extracted_metadata = extract_metadata_from_parameter(
-                        metadata,
-                        image_path,
-                        nsfw,
-                        info_logger,
-                        debug_logger,
-                    )
+        # Create the table if it doesn't exist and update its columns and indexes
+        backend.prepare_table(conn, table_name, table_columns, info_logger)
 
-                    debug_logger.info(
-                        f"Extracted metadata from {image_path} is {extracted_metadata}"
-                    )
+        # Load the SHA256 values once instead of querying the table for every image
+        known_metadata = KnownMetadata(
+            conn, table_name, columns, info_logger, debug_logger, known_hashes == "bloom", backend.placeholder
+        )
 
-                    # Check if metadata already exists in database
-                    row_count = check_if_metadata_exists(
-                        conn, extracted_metadata, table_name, debug_logger
-                    )
+        batch = MetadataBatch(
+            backend, table_name, columns, info_logger, extraction_logger, batch_size, flush_interval, writers,
+            writer_queue_depth,
+        )
+        stat_cache = StatCache(stat_cache_path) if stat_cache_path else None
 
-                    debug_logger.info(
-                        f"Metadata already exists {row_count} times in database"
-                    )
+        # The stages run in their own threads, this thread checks the rows and hands them to the writers
+        pipeline = ExtractionPipeline(
+            image_folder, stat_cache, known_metadata, backend, hashes, nsfw, info_logger, debug_logger,
+            read_workers, nsfw_batch_size, queue_depth, report_interval, batch,
+        )
+        for image_path, stat, extracted_metadata in pipeline.results():
+            if stat is not None:
+                stat_cache.put(image_path, stat, extracted_metadata["SHA256"])
 
-                    if row_count == 0:
-                        # Insert metadata into database
-                        insert_metadata_into_database(
-                            conn,
-                            extracted_metadata,
-                            table_name,
-                            columns,
-                            info_logger,
-                            extraction_logger,
-                        )
-                        inserted_count += 1
-                    elif row_count == 1:
-                        # Check if metadata in database is the same as the extracted metadata
-                        equal = check_if_metadata_equal(
-                            conn,
-                            metadata,
-                            table_name,
-                            columns,
-                            info_logger,
-                            debug_logger,
-                        )
+            # An image with the same hash is still being written: wait for it, so the later image wins
+            # and the confirmation queries of the Bloom filter see it
+            if batch.is_pending(extracted_metadata.get("SHA256")):
+                batch.wait()
 
-                        # Update metadata in database
-                        if equal == False:
-                            update_metadata_in_database(
-                                conn,
-                                extracted_metadata,
-                                table_name,
-                                columns,
-                                info_logger,
-                                extraction_logger,
-                            )
-                            updated_count += 1
-                        else:
-                            debug_logger.debug(
-                                f"Metadata in database is the same as the extracted metadata."
-                            )
-                    else:
-                        info_logger.error(f"Row count is {row_count}. Expected 0 or 1.")
+            # Check if metadata already exists in database
+            row_count = known_metadata.row_count(extracted_metadata)
+
+            debug_logger.info(
+                f"Metadata already exists {row_count} times in database"
+            )
+
+            if row_count == 0:
+                # Insert metadata into database with the next batch
+                batch.insert(extracted_metadata)
+                known_metadata.add(extracted_metadata)
+            elif row_count == 1:
+                # Check if metadata in database is the same as the extracted metadata
+                equal = known_metadata.is_equal(extracted_metadata)
+
+                # Update metadata in database
+                if equal == False:
+                    batch.update(extracted_metadata)
+                    known_metadata.add(extracted_metadata)
+                else:
+                    debug_logger.debug(
+                        f"Metadata in database is the same as the extracted metadata."
+                    )
+                    batch.flush_if_due()
+            else:
+                info_logger.error(f"Row count is {row_count}. Expected 0 or 1.")
 
-        # Close the database connection
+        # Write the remaining rows and close the database connections
+        batch.close()
         conn.close()
+        if stat_cache is not None:
+            stat_cache.close()
+        inserted_count = batch.inserted_count
+        updated_count = batch.updated_count
         total_count = str(inserted_count + updated_count)
         end_time = datetime.now()
         time_difference = str(end_time - start_time)
         info_logger.info(
-            f"Script finished. Duration: {time_difference}, Total count: {total_count} ({str(inserted_count)} inserted, {str(updated_count)} updated)."
+            f"Script finished. Duration: {time_difference}, Total count: {total_count} ({str(inserted_count)} inserted, {str(updated_count)} updated, {pipeline.counts['unchanged']} unchanged skipped)."
         )
     except Exception as e:
         info_logger.error("An unexpected error occurred: %s", str(e))
@@ -0,0 +1,95 @@
+import importlib
+
+# Scoring models: module in tensorflow.keras.applications and name of the constructor.
+# Nothing is imported until a model is loaded, so only the selected architecture is pulled in.
+MODEL_SELECTION = {
+    1: ("xception", "Xception"),
+    2: ("vgg16", "VGG16"),
+    3: ("vgg19", "VGG19"),
+    4: ("resnet", "ResNet50"),
+    5: ("resnet_v2", "ResNet50V2"),
+    6: ("resnet", "ResNet101"),
+    7: ("resnet_v2", "ResNet101V2"),
+    8: ("resnet", "ResNet152"),
+    9: ("resnet_v2", "ResNet152V2"),
+    10: ("inception_v3", "InceptionV3"),
+    11: ("inception_resnet_v2", "InceptionResNetV2"),
+    12: ("mobilenet", "MobileNet"),
+    13: ("mobilenet_v2", "MobileNetV2"),
+    14: ("densenet", "DenseNet121"),
+    15: ("densenet", "DenseNet169"),
+    16: ("densenet", "DenseNet201"),
+    17: ("nasnet", "NASNetMobile"),
+    18: ("nasnet", "NASNetLarge"),
+    19: ("efficientnet", "EfficientNetB0"),
+    20: ("efficientnet", "EfficientNetB1"),
+    21: ("efficientnet", "EfficientNetB2"),
+    22: ("efficientnet", "EfficientNetB3"),
+    23: ("efficientnet", "EfficientNetB4"),
+    24: ("efficientnet", "EfficientNetB5"),
+    25: ("efficientnet", "EfficientNetB6"),
+    26: ("efficientnet", "EfficientNetB7"),
+    27: ("efficientnet_v2", "EfficientNetV2B0"),
+    28: ("efficientnet_v2", "EfficientNetV2B1"),
+    29: ("efficientnet_v2", "EfficientNetV2B2"),
+    30: ("efficientnet_v2", "EfficientNetV2B3"),
+    31: ("efficientnet_v2", "EfficientNetV2S"),
+    32: ("efficientnet_v2", "EfficientNetV2M"),
+    33: ("efficientnet_v2", "EfficientNetV2L"),
+    34: ("convnext", "ConvNeXtTiny"),
+    35: ("convnext", "ConvNeXtSmall"),
+    36: ("convnext", "ConvNeXtBase"),
+    37: ("convnext", "ConvNeXtLarge"),
+    38: ("convnext", "ConvNeXtXLarge")
+}
+
+
+def get_model_name(model_type):
+    return MODEL_SELECTION[int(model_type)][1]
+
+
+def get_target_size(model_type):
+    # Determine the input size of the selected scoring model
+    if model_type in [2, 3, 4, 5, 6, 7, 8, 9, 12, 13, 14, 15, 16, 17, 19, 27, 34, 35, 36, 37, 38]:
+        return 224, 224
+    elif model_type in [20, 28]:
+        return 240, 240
+    elif model_type in [21, 29]:
+        return 260, 260
+    elif model_type in [1, 10, 11]:
+        return 299, 299
+    elif model_type in [22, 30]:
+        return 300, 300
+    elif model_type in [18]:
+        return 331, 331
+    elif model_type in [23]:
+        return 380, 380
+    elif model_type in [31]:
+        return 384, 384
+    elif model_type in [24]:
+        return 456, 456
+    elif model_type in [32, 33]:
+        return 480, 480
+    elif model_type in [25]:
+        return 528, 528
+    elif model_type in [26]:
+        return 600, 600
+    else:
+        exit("Error 1")
+
+
+def _import_application(model_type):
+    if int(model_type) not in MODEL_SELECTION:
+        exit("Error 2")
+    module_name, _ = MODEL_SELECTION[int(model_type)]
+    return importlib.import_module(f"tensorflow.keras.applications.{module_name}")
+
+
+def load_model_class(model_type):
+    # Returns the constructor of the selected model, e.g. MobileNetV2
+    return getattr(_import_application(model_type), get_model_name(model_type))
+
+
+def load_preprocess_input(model_type):
+    # Each model family normalizes its input differently
+    return _import_application(model_type).preprocess_input
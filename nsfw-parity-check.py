@@ -0,0 +1,44 @@
+import sys
+import time
+from pathlib import Path
+import opennsfw2 as n2
+from image_analysis import ImageAnalyzer
+
+# Usage: python nsfw-parity-check.py <image folder> [number of images]
+# Compares the batched NSFW probabilities of the filter with opennsfw2.predict_image and times both
+
+# Largest accepted difference between the two probabilities
+TOLERANCE = 1e-4
+
+if len(sys.argv) not in [2, 3]:
+    exit("Usage: python nsfw-parity-check.py <image folder> [number of images]")
+
+valid_extensions = ('.png', '.jpg', '.jpeg')
+image_files = sorted(file_path for file_path in Path(sys.argv[1]).rglob('*')
+                     if file_path.suffix.lower() in valid_extensions)
+image_files = image_files[:int(sys.argv[2]) if len(sys.argv) == 3 else 200]
+if not image_files:
+    exit("No images found.")
+
+# Mode 1 is the NSFW-only sort
+analyzer = ImageAnalyzer(mode=1)
+start = time.perf_counter()
+batched = {file_path: result.nsfw_probability for file_path, result in analyzer.analyze_files(image_files)}
+batched_time = time.perf_counter() - start
+analyzer.close()
+
+start = time.perf_counter()
+reference = {file_path: n2.predict_image(str(file_path)) for file_path in image_files}
+reference_time = time.perf_counter() - start
+
+mismatches = 0
+for file_path in image_files:
+    if batched[file_path] is None or abs(batched[file_path] - reference[file_path]) > TOLERANCE:
+        mismatches += 1
+        print(f"Mismatch for '{file_path.name}': {batched[file_path]} != {reference[file_path]}")
+
+print(f"Batched: {len(image_files) / batched_time:.1f} images/s, "
+      f"predict_image: {len(image_files) / reference_time:.1f} images/s")
+if mismatches:
+    exit(f"{mismatches} of {len(image_files)} probabilities differ by more than {TOLERANCE}.")
+print(f"All {len(image_files)} probabilities match within {TOLERANCE}.")
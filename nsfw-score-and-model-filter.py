@@ -1,35 +1,18 @@
-import shutil
+import threading
 from pathlib import Path
-import PIL
 import json
-from PIL import Image
-import re
-import numpy as np
-import opennsfw2 as n2
-from tensorflow.keras.applications import (Xception, VGG16, VGG19, ResNet50, ResNet50V2, ResNet101, ResNet101V2,
-                                           ResNet152, ResNet152V2, InceptionV3, InceptionResNetV2, MobileNet,
-                                           MobileNetV2, DenseNet121, DenseNet169, DenseNet201, NASNetMobile,
-                                           NASNetLarge, EfficientNetB0, EfficientNetB1, EfficientNetB2, EfficientNetB3,
-                                           EfficientNetB4, EfficientNetB5, EfficientNetB6, EfficientNetB7,
-                                           EfficientNetV2B0, EfficientNetV2B1, EfficientNetV2B2, EfficientNetV2B3,
-                                           EfficientNetV2S, EfficientNetV2M, EfficientNetV2L, ConvNeXtTiny,
-                                           ConvNeXtSmall, ConvNeXtBase, ConvNeXtLarge, ConvNeXtXLarge)
-from tensorflow.keras.applications.xception import preprocess_input as xception_preprocess_input
-from tensorflow.keras.applications.resnet import preprocess_input as resnet_preprocess_input
-from tensorflow.keras.applications.resnet_v2 import preprocess_input as resnetv2_preprocess_input
-from tensorflow.keras.applications.vgg16 import preprocess_input as vgg16_preprocess_input
-from tensorflow.keras.applications.vgg19 import preprocess_input as vgg19_preprocess_input
-from tensorflow.keras.applications.densenet import preprocess_input as densenet_preprocess_input
-from tensorflow.keras.applications.inception_v3 import preprocess_input as inceptionv3_preprocess_input
-from tensorflow.keras.applications.inception_resnet_v2 import preprocess_input as inception_resnetv2_preprocess_input
-from tensorflow.keras.applications.mobilenet import preprocess_input as mobilenet_preprocess_input
-from tensorflow.keras.applications.mobilenet_v2 import preprocess_input as mobilenetv2_preprocess_input
-from tensorflow.keras.applications.nasnet import preprocess_input as nasnet_preprocess_input
-from tensorflow.keras.applications.efficientnet import preprocess_input as efficientnet_preprocess_input
-from tensorflow.keras.applications.efficientnet_v2 import preprocess_input as efficientnetv2_preprocess_input
-from tensorflow.keras.applications.convnext import preprocess_input as convnext_preprocess_input
-from tensorflow.keras.preprocessing import image
-from PyQt5.QtWidgets import QApplication, QFileDialog
+from dialogs import get_folder_path
+from file_operations import LINK_MODES, VERIFY_MODES, FileOperationExecutor, print_line
+from processing_journal import ProcessingJournal
+from results_manifest import ResultsManifest
+from tag_index import TagIndex
+from watch_folder import FolderWatcher
+from buckets import (NSFW_RANGES, SCORE_RANGES_SMALL, SCORE_RANGES_BIG, SMALL_SCORE_MODELS, BIG_SCORE_MODELS,
+                     get_folder_name)
+from inference_backends import BACKENDS
+from model_registry import get_model_name
+from image_analysis import (NSFW_MODES, SCORE_MODES, MODEL_MODES, PARAMETER_MODES, ImageAnalyzer,
+                            analyze_files_in_workers)
 
 # Config path
 config_path = Path("nsfw-score-and-model-filter_config.json")
@@ -48,11 +31,29 @@ strict_parameters = None
 split_words = None
 model_type = None
 score_or_class = None
-
-print("Initializing...")
-
-# Create the application
-app = QApplication([])
+batch_size = None
+prefetch_workers = None
+prefetch_depth = None
+file_workers = None
+file_queue_depth = None
+workers = None
+result_cache = None
+result_cache_size = None
+use_journal = None
+journal_flush_every = None
+daemon = None
+daemon_settle_time = None
+daemon_batch_wait = None
+inference_backend = None
+quantize = None
+model_cache_folder = None
+dry_run = None
+plan_file = None
+link_mode = None
+verify_moves = None
+tag_index = None
+manifest = None
+analysis_only = None
 
 # Initialize variables
 nsfw_folder_name = None
@@ -60,226 +61,108 @@ score_folder_name = None
 model_folder_name = None
 score_range_type = None
 
-# Define the regular expression pattern for invalid characters
-invalid_chars_pattern = r'[<>:"-_/\\|?*().;#{}[\]\n]'
-
-# Constants for NSFW ranges
-NSFW_RANGES = [
-    (0.0, 0.2),
-    (0.2, 0.4),
-    (0.4, 0.6),
-    (0.6, 0.8),
-    (0.8, 0.9),
-    (0.9, 0.95),
-    (0.95, 0.99),
-    (0.99, 0.995),
-    (0.995, 1.0)
-]
-
-# Constants for score ranges
-SCORE_RANGES_SMALL = [
-    (0.0, 0.2),
-    (0.2, 0.4),
-    (0.4, 0.6),
-    (0.6, 0.8),
-    (0.8, 1.0)
-]
-
-SCORE_RANGES_BIG = [
-    (0, 2),
-    (2, 4),
-    (4, 6),
-    (6, 8),
-    (8, 10)
-]
-
-SMALL_SCORE_MODELS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27,
-                      28, 29, 30, 31, 32, 33]
-BIG_SCORE_MODELS = [34, 35, 36, 37, 38]
-
-# Model selection dictionary
-MODEL_SELECTION = {
-    1: Xception,
-    2: VGG16,
-    3: VGG19,
-    4: ResNet50,
-    5: ResNet50V2,
-    6: ResNet101,
-    7: ResNet101V2,
-    8: ResNet152,
-    9: ResNet152V2,
-    10: InceptionV3,
-    11: InceptionResNetV2,
-    12: MobileNet,
-    13: MobileNetV2,
-    14: DenseNet121,
-    15: DenseNet169,
-    16: DenseNet201,
-    17: NASNetMobile,
-    18: NASNetLarge,
-    19: EfficientNetB0,
-    20: EfficientNetB1,
-    21: EfficientNetB2,
-    22: EfficientNetB3,
-    23: EfficientNetB4,
-    24: EfficientNetB5,
-    25: EfficientNetB6,
-    26: EfficientNetB7,
-    27: EfficientNetV2B0,
-    28: EfficientNetV2B1,
-    29: EfficientNetV2B2,
-    30: EfficientNetV2B3,
-    31: EfficientNetV2S,
-    32: EfficientNetV2M,
-    33: EfficientNetV2L,
-    34: ConvNeXtTiny,
-    35: ConvNeXtSmall,
-    36: ConvNeXtBase,
-    37: ConvNeXtLarge,
-    38: ConvNeXtXLarge
-}
-
-
-# Function to check the range for a value and return the corresponding folder name
-def get_folder_name(value, ranges):
-    if value is None:
-        return 'None'
-    for i, (start, end) in enumerate(ranges):
-        if start <= value < end:
-            return f"{start}-{end}"
-    return 'None'
-
-
-def is_nsfw(image_path):
-    try:
-        # Load image and resize to maximum of 512 pixels
-        img = Image.open(image_path)
-        img.thumbnail((512, 512))
-
-        # Check NSFW probability using the NSFW detector
-        nsfw_probability = n2.predict_image(image_path)
-        return nsfw_probability
-    except (PIL.UnidentifiedImageError, OSError) as e:
-        print(f"Skipping image '{image_path.name}' due to an error: {str(e)}")
-        return None
-
-
-def get_image_score(image_path):
-    # Load and preprocess the image
-    if model_type in [2, 3, 4, 5, 6, 7, 8, 9, 12, 13, 14, 15, 16, 17, 19, 27, 34, 35, 36, 37, 38]:
-        img = image.load_img(image_path, target_size=(224, 224))
-    elif model_type in [20, 28]:
-        img = image.load_img(image_path, target_size=(240, 240))
-    elif model_type in [21, 29]:
-        img = image.load_img(image_path, target_size=(260, 260))
-    elif model_type in [1, 10, 11]:
-        img = image.load_img(image_path, target_size=(299, 299))
-    elif model_type in [22, 30]:
-        img = image.load_img(image_path, target_size=(300, 300))
-    elif model_type in [18]:
-        img = image.load_img(image_path, target_size=(331, 331))
-    elif model_type in [23]:
-        img = image.load_img(image_path, target_size=(380, 380))
-    elif model_type in [31]:
-        img = image.load_img(image_path, target_size=(384, 384))
-    elif model_type in [24]:
-        img = image.load_img(image_path, target_size=(456, 456))
-    elif model_type in [32, 33]:
-        img = image.load_img(image_path, target_size=(480, 480))
-    elif model_type in [25]:
-        img = image.load_img(image_path, target_size=(528, 528))
-    elif model_type in [26]:
-        img = image.load_img(image_path, target_size=(600, 600))
-    else:
-        exit("Error 1")
-
-    img = image.img_to_array(img)
-    img = np.expand_dims(img, axis=0)
-
-    if model_type in [1]:
-        img = xception_preprocess_input(img)
-    elif model_type in [2]:
-        img = vgg16_preprocess_input(img)
-    elif model_type in [3]:
-        img = vgg19_preprocess_input(img)
-    elif model_type in [4, 6, 8]:
-        img = resnet_preprocess_input(img)
-    elif model_type in [5, 7, 9]:
-        img = resnetv2_preprocess_input(img)
-    elif model_type in [10]:
-        img = inceptionv3_preprocess_input(img)
-    elif model_type in [11]:
-        img = inception_resnetv2_preprocess_input(img)
-    elif model_type in [12]:
-        img = mobilenet_preprocess_input(img)
-    elif model_type in [13]:
-        img = mobilenetv2_preprocess_input(img)
-    elif model_type in [14, 15, 16]:
-        img = densenet_preprocess_input(img)
-    elif model_type in [17, 18]:
-        img = nasnet_preprocess_input(img)
-    elif model_type in range(19, 26):
-        img = efficientnet_preprocess_input(img)
-    elif model_type in range(27, 33):
-        img = efficientnetv2_preprocess_input(img)
-    elif model_type in range(34, 39):
-        img = convnext_preprocess_input(img)
-    else:
-        exit("Error 2")
-
-    # Use the pre-trained model to predict the image class probabilities
-    predictions = model.predict(img)
-    predicted_class = np.argmax(predictions)
-
-    # Return the predicted class index and corresponding score
-    return predicted_class, predictions[0][predicted_class]
-
-
-def extract_model_name(file_path):
-    # Extract the model name from the metadata dictionary
-    image = Image.open(file_path)
-    metadata = image.info
-    params = metadata.get("parameters", "")
-    model_start = params.find("Model:") + len("Model:")
-    model_end = params.find(",", model_start)
-    model_name = params[model_start:model_end].strip()
-    return model_name
-
-
-def extract_parameters(file_path):
-    image = Image.open(file_path)
-    metadata = image.info
-    params = metadata.get("parameters", "")
-    if "Negative prompt:" in params:
-        result = params.split("Negative prompt:", 1)[0].strip()
-    elif "Steps:" in params:
-        result = params.split("Steps:", 1)[0].strip()
-    else:
-        exit("Error 6")
-    cleaned_result = re.sub(invalid_chars_pattern, '', result)
+# Number of images scored in a single forward pass
+DEFAULT_BATCH_SIZE = 32
 
-    if ',' not in cleaned_result or split_words:
-        # Split the cleaned folder name by whitespaces and remove invalid characters
-        removed_commas = re.sub(r',', '', cleaned_result)
-        separate_list = re.split(r'\s+', removed_commas)
-    else:
-        # Split the cleaned folder name by commas and remove invalid characters
-        separate_list = re.split(r',', cleaned_result)
+# Threads decoding the upcoming images and the number of images decoded ahead of the current batch
+DEFAULT_PREFETCH_WORKERS = 4
+DEFAULT_PREFETCH_DEPTH = 64
 
-    parameter_list = [item.strip() for item in separate_list if item.strip() and len(item.strip()) <= 100]
-    return parameter_list
+# Threads moving/copying the sorted images and the number of operations allowed to wait for them
+DEFAULT_FILE_WORKERS = 4
+DEFAULT_FILE_QUEUE_DEPTH = 256
 
+# Processes analyzing a share of the images each, 1 analyzes everything in this process
+DEFAULT_WORKERS = 1
 
-def get_folder_path(message):
-    while True:
-        print(message)
-        folder_path_input = QFileDialog().getExistingDirectory(None, message)
+# Maximum number of entries kept in the result cache, the least recently used ones are evicted first
+DEFAULT_RESULT_CACHE_SIZE = 1000000
 
-        if folder_path_input:
-            folder_path = Path(folder_path_input)
-            return folder_path
-        else:
-            print("Invalid input selected. Please try again.\n")
+# Journal of the finished images, kept in the output folder until the run completes
+JOURNAL_FILE_NAME = "image-filter-journal.jsonl"
+DEFAULT_USE_JOURNAL = "y"
+DEFAULT_JOURNAL_FLUSH_EVERY = 256
+
+# Daemon mode: seconds a new file must stay unchanged before it is analyzed, and seconds to wait
+# for more files to fill a batch once the first one is ready
+DEFAULT_DAEMON = "n"
+DEFAULT_DAEMON_SETTLE_TIME = 2
+DEFAULT_DAEMON_BATCH_WAIT = 1
+
+# Scoring model inference: "keras", "onnx" or "tflite", optional int8 quantization for the converted models
+DEFAULT_INFERENCE_BACKEND = "keras"
+DEFAULT_QUANTIZE = "n"
+DEFAULT_MODEL_CACHE_FOLDER = "model_cache"
+
+# Dry run: only print the routing plan, and write it to plan_file if set
+DEFAULT_DRY_RUN = "n"
+
+# How copy mode writes an image: "copy", "hardlink", "reflink", "symlink" or "auto", links fall back to a copy
+DEFAULT_LINK_MODE = "copy"
+
+# Check of a move to another file system before the source is removed: "n", "size" or "sha256"
+DEFAULT_VERIFY_MOVES = "n"
+
+# Analysis only: write the results to the manifest without moving or copying any image
+DEFAULT_ANALYSIS_ONLY = "n"
+
+def run_plan(plan):
+    # Write the manifest rows of the planned images, create the folders, run the moves/copies and record each
+    # image once its operations succeeded
+    if results_manifest is not None:
+        results_manifest.commit()
+    for (file_path, destinations), (_, transfers) in zip(plan, file_operations.execute(plan)):
+        record_completion(file_path, transfers)
+        if results_manifest is not None:
+            record_moves(file_path, destinations, transfers)
+
+
+def record_moves(file_path, destinations, transfers):
+    # The manifest follows each image to its destination once the move succeeded
+    for (destination_folder, move), (_, future) in zip(destinations, transfers):
+        if not move or future is None:
+            continue
+
+        def finish(future, destination_file_path=destination_folder / file_path.name):
+            if future.exception() is None:
+                results_manifest.move(file_path, destination_file_path)
+
+        future.add_done_callback(finish)
+
+
+def record_completion(file_path, transfers):
+    # The image is finished once all of its file operations succeeded
+    if processing_journal is None:
+        return
+    destinations = [destination_folder for destination_folder, _ in transfers]
+    futures = [future for _, future in transfers if future is not None]
+    if not futures:
+        processing_journal.record(file_path, destinations)
+        return
+
+    remaining = [len(futures)]
+    remaining_lock = threading.Lock()
+
+    def finish(_):
+        with remaining_lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and all(future.exception() is None for future in futures):
+            processing_journal.record(file_path, destinations)
+
+    for future in futures:
+        future.add_done_callback(finish)
+
+
+def watch_results(analyzer, watcher):
+    # Analyze the images written to the input folder in micro-batches until the daemon is stopped
+    while True:
+        new_files = watcher.wait_for_files(batch_size, daemon_batch_wait)
+        # Other programs may have changed the destination folders since the last cycle
+        file_operations.refresh()
+        if processing_journal is not None:
+            new_files = [file_path for file_path in new_files if not processing_journal.is_completed(file_path)]
+        yield from analyzer.analyze_files(new_files)
 
 
 def invalid_input():
@@ -333,7 +216,75 @@ def check_config():
             invalid_config("move_or_copy")
             return False
 
-        if mode in [2, 4, 6, 7, 9, 10, 11, 12, 13, 14, 15]:
+        for key in ["batch_size", "prefetch_workers", "prefetch_depth", "file_workers", "file_queue_depth",
+                    "workers", "result_cache_size", "journal_flush_every"]:
+            if key in config_data:
+                if not isinstance(config_data[key], int) or config_data[key] < 1:
+                    invalid_config(key)
+                    return False
+
+        if config_data.get("result_cache") is not None and not isinstance(config_data["result_cache"], str):
+            invalid_config("result_cache")
+            return False
+
+        if config_data.get("journal", DEFAULT_USE_JOURNAL) not in ["y", "n"]:
+            invalid_config("journal")
+            return False
+
+        if config_data.get("daemon", DEFAULT_DAEMON) not in ["y", "n"]:
+            invalid_config("daemon")
+            return False
+
+        for key in ["daemon_settle_time", "daemon_batch_wait"]:
+            if key in config_data:
+                if not isinstance(config_data[key], (int, float)) or config_data[key] < 0:
+                    invalid_config(key)
+                    return False
+
+        if config_data.get("inference_backend", DEFAULT_INFERENCE_BACKEND) not in BACKENDS:
+            invalid_config("inference_backend")
+            return False
+
+        if config_data.get("quantize", DEFAULT_QUANTIZE) not in ["y", "n"]:
+            invalid_config("quantize")
+            return False
+
+        if not isinstance(config_data.get("model_cache_folder", DEFAULT_MODEL_CACHE_FOLDER), str):
+            invalid_config("model_cache_folder")
+            return False
+
+        if config_data.get("dry_run", DEFAULT_DRY_RUN) not in ["y", "n"]:
+            invalid_config("dry_run")
+            return False
+
+        if config_data.get("plan_file") is not None and not isinstance(config_data["plan_file"], str):
+            invalid_config("plan_file")
+            return False
+
+        if config_data.get("link_mode", DEFAULT_LINK_MODE) not in LINK_MODES:
+            invalid_config("link_mode")
+            return False
+
+        if config_data.get("verify_moves", DEFAULT_VERIFY_MOVES) not in VERIFY_MODES:
+            invalid_config("verify_moves")
+            return False
+
+        if config_data.get("tag_index") is not None and not isinstance(config_data["tag_index"], str):
+            invalid_config("tag_index")
+            return False
+
+        if config_data.get("manifest") is not None and not isinstance(config_data["manifest"], str):
+            invalid_config("manifest")
+            return False
+
+        if config_data.get("analysis_only", DEFAULT_ANALYSIS_ONLY) not in ["y", "n"]:
+            invalid_config("analysis_only")
+            return False
+        if config_data.get("analysis_only") == "y" and config_data.get("manifest") is None:
+            config_key_not_exists("manifest")
+            return False
+
+        if mode in SCORE_MODES:
             if "model_type" not in config_data:
                 config_key_not_exists("model_type")
                 return False
@@ -344,7 +295,9 @@ def check_config():
             model_type = config_data["model_type"]
             score_or_class = config_data["score_or_class"]
 
-            if model_type not in [i for i in range(1, 39)]:
+            # A single model type or a list of them
+            model_types = model_type if isinstance(model_type, list) else [model_type]
+            if not model_types or any(t not in [i for i in range(1, 39)] for t in model_types):
                 invalid_config("model_type")
                 return False
             if score_or_class not in ["s", "c"]:
@@ -401,289 +354,486 @@ def check_config():
         return False
 
 
-while True:
-    if check_config():
-        print("Config values successfully checked.")
-        print("Loading config...")
-
-        with open(config_path, 'r') as config_file:
-            config_data = json.load(config_file)
-
-            autonomous = config_data["autonomous"]
-            mode = config_data["mode"]
-            input_folder = Path(config_data["input_folder"])
-            output_folder = Path(config_data["output_folder"])
-            move_or_copy = config_data["move_or_copy"]
-
-            if mode in [2, 4, 6, 7, 9, 10, 11, 12, 13, 14, 15]:
-                model_type = config_data["model_type"]
-                score_or_class = config_data["score_or_class"]
-
-            if mode == 16:
-                experimental = config_data["experimental"]
-                own_parameters = config_data["own_parameters"]
-                split_words = config_data["split_words"]
+# Spawned worker processes import this file again, only the main process runs the filter
+if __name__ == "__main__":
+    print("Initializing...")
 
-                if own_parameters == "y":
-                    parameters = config_data["parameters"]
-                    strict_parameters = config_data["strict_parameters"]
+    while True:
+        if check_config():
+            print("Config values successfully checked.")
+            print("Loading config...")
+
+            with open(config_path, 'r') as config_file:
+                config_data = json.load(config_file)
+
+                autonomous = config_data["autonomous"]
+                mode = config_data["mode"]
+                input_folder = Path(config_data["input_folder"])
+                output_folder = Path(config_data["output_folder"])
+                move_or_copy = config_data["move_or_copy"]
+                batch_size = config_data.get("batch_size", DEFAULT_BATCH_SIZE)
+                prefetch_workers = config_data.get("prefetch_workers", DEFAULT_PREFETCH_WORKERS)
+                prefetch_depth = config_data.get("prefetch_depth", DEFAULT_PREFETCH_DEPTH)
+                file_workers = config_data.get("file_workers", DEFAULT_FILE_WORKERS)
+                file_queue_depth = config_data.get("file_queue_depth", DEFAULT_FILE_QUEUE_DEPTH)
+                workers = config_data.get("workers", DEFAULT_WORKERS)
+                result_cache = config_data.get("result_cache")
+                result_cache_size = config_data.get("result_cache_size", DEFAULT_RESULT_CACHE_SIZE)
+                use_journal = config_data.get("journal", DEFAULT_USE_JOURNAL)
+                journal_flush_every = config_data.get("journal_flush_every", DEFAULT_JOURNAL_FLUSH_EVERY)
+                daemon = config_data.get("daemon", DEFAULT_DAEMON)
+                daemon_settle_time = config_data.get("daemon_settle_time", DEFAULT_DAEMON_SETTLE_TIME)
+                daemon_batch_wait = config_data.get("daemon_batch_wait", DEFAULT_DAEMON_BATCH_WAIT)
+                inference_backend = config_data.get("inference_backend", DEFAULT_INFERENCE_BACKEND)
+                quantize = config_data.get("quantize", DEFAULT_QUANTIZE)
+                model_cache_folder = config_data.get("model_cache_folder", DEFAULT_MODEL_CACHE_FOLDER)
+                dry_run = config_data.get("dry_run", DEFAULT_DRY_RUN)
+                plan_file = config_data.get("plan_file")
+                link_mode = config_data.get("link_mode", DEFAULT_LINK_MODE)
+                verify_moves = config_data.get("verify_moves", DEFAULT_VERIFY_MOVES)
+                tag_index = config_data.get("tag_index")
+                manifest = config_data.get("manifest")
+                analysis_only = config_data.get("analysis_only", DEFAULT_ANALYSIS_ONLY)
+
+                if mode in SCORE_MODES:
+                    model_type = config_data["model_type"]
+                    score_or_class = config_data["score_or_class"]
+
+                if mode == 16:
+                    experimental = config_data["experimental"]
+                    own_parameters = config_data["own_parameters"]
+                    split_words = config_data["split_words"]
+
+                    if own_parameters == "y":
+                        parameters = config_data["parameters"]
+                        strict_parameters = config_data["strict_parameters"]
+
+            print("Config successfully loaded and applied.")
+            break
+        else:
+            if mode is None:
+                while True:
+                    mode = input("Enter Mode:\n1 = NSFW\n2 = Score\n3 = Model\n4 = NSFW/Model\n5 = NSFW/Score\n6 = "
+                                 "Score/NSFW\n7 = Score/Model\n8 = Model/NSFW\n9 = Model/Score\n10 = NSFW/Score/Model\n11 "
+                                 "= NSFW/Model/Score\n12 = Score/NSFW/Model\n13 = Score/Model/NSFW\n14 = "
+                                 "Model/NSFW/Score\n15 = Model/Score/NSFW\n16 = Parameter (Experimental)\nSelected Mode: ")
+
+                    if mode in [str(i) for i in range(1, 16)]:
+                        mode = int(mode)
+                        break
+                    elif mode == "16":
+                        mode = int(mode)
+                        if experimental is None:
+                            while True:
+                                experimental = input("This mode is experimental and creates a lot of duplicate "
+                                                     "files.\nAre you sure you want to continue? (y = yes, n = no): ")
+                                if experimental == "y" or experimental == "n":
+                                    break
+                                invalid_input()
+
+                        if own_parameters is None:
+                            while True:
+                                own_parameters_input = input("Do you wanna filter by own parameters? (y = yes, n = no): ")
+                                if own_parameters_input == "y":
+                                    own_parameters = input("Type your filter parameters separated by commas (,): ")
+                                    own_parameters = own_parameters.replace(" ", "")  # Remove any spaces in the input
+                                    parameters = own_parameters.split(",")  # Split the input at each comma
+
+                                    if strict_parameters is None:
+                                        while True:
+                                            strict_parameters_input = input("Do you wanna filter by strictly all "
+                                                                            "parameters? (y = yes, n = no): ")
+                                            if strict_parameters_input == "y":
+                                                strict_parameters = True
+                                                break
+                                            elif strict_parameters_input == "n":
+                                                strict_parameters = False
+                                                break
+                                            invalid_input()
+                                    break
+                                elif own_parameters_input == "n":
+                                    parameters = None
+                                    break
+                                invalid_input()
+                        if split_words is None:
+                            while True:
+                                split_words_input = input("Do you wanna split each word from existing images? (y = yes, "
+                                                          "n = no): ")
+                                if split_words_input == "y":
+                                    split_words = True
+                                    break
+                                elif split_words_input == "n":
+                                    split_words = False
+                                    break
+                                invalid_input()
+                            break
+                    invalid_input()
+                break
 
-        print("Config successfully loaded and applied.")
-        break
-    else:
-        if mode is None:
+    if mode in SCORE_MODES:
+        if model_type is None:
             while True:
-                mode = input("Enter Mode:\n1 = NSFW\n2 = Score\n3 = Model\n4 = NSFW/Model\n5 = NSFW/Score\n6 = "
-                             "Score/NSFW\n7 = Score/Model\n8 = Model/NSFW\n9 = Model/Score\n10 = NSFW/Score/Model\n11 "
-                             "= NSFW/Model/Score\n12 = Score/NSFW/Model\n13 = Score/Model/NSFW\n14 = "
-                             "Model/NSFW/Score\n15 = Model/Score/NSFW\n16 = Parameter (Experimental)\nSelected Mode: ")
+                model_type = input("Which Scoring Model do you wanna use?\n1 = Xception\n2 = VGG16\n3 = VGG19\n4 = "
+                                   "ResNet50\n5 = ResNet50V2\n6 = ResNet101\n7 = ResNet101V2\n8 = ResNet152\n9 = "
+                                   "ResNet152V2\n10 = InceptionV3\n11 = InceptionResNetV2\n12 = MobileNet\13 = "
+                                   "MobileNetV2\n14 = DenseNet121\n15 = DenseNet169\n16 = DenseNet201\n17 = "
+                                   "NASNetMobile\n18 = NASNetLarge\n19 = EfficientNetB0\n20 = EfficientNetB1\n21 = "
+                                   "EfficientNetB2\n22 = EfficientNetB3\n23 = EfficientNetB4\n24 = EfficientNetB5\n25 = "
+                                   "EfficientNetB6\n26 = EfficientNetB7\n27 = EfficientNetV2B0\n28 = EfficientNetV2B1\n29 "
+                                   "= EfficientNetV2B2\n30 = EfficientNetV2B3\n31 = EfficientNetV2S\n32 = "
+                                   "EfficientNetV2M\n33 = EfficientNetV2L\n34 = ConvNeXtTiny\n35 = ConvNeXtSmall\n36 = "
+                                   "ConvNeXtBase\n37 = ConvNeXtLarge\n38 = ConvNeXtXLarge\n"
+                                   "Selected Scoring Model(s), separated by commas: ")
+
+                selected_types = [t.strip() for t in model_type.split(",")]
+                if all(t in [str(i) for i in range(1, 39)] for t in selected_types):
+                    model_type = [int(t) for t in selected_types]
+                    if len(model_type) == 1:
+                        model_type = model_type[0]
+                    break
+                invalid_input()
 
-                if mode in [str(i) for i in range(1, 16)]:
-                    mode = int(mode)
+        if score_or_class is None:
+            while True:
+                score_or_class = input("Do you wanna filter by score or class? (s = score, c = class) ")
+                if score_or_class == "s" or score_or_class == "c":
                     break
-                elif mode == "16":
-                    mode = int(mode)
-                    if experimental is None:
-                        while True:
-                            experimental = input("This mode is experimental and creates a lot of duplicate "
-                                                 "files.\nAre you sure you want to continue? (y = yes, n = no): ")
-                            if experimental == "y" or experimental == "n":
-                                break
-                            invalid_input()
-
-                    if own_parameters is None:
-                        while True:
-                            own_parameters_input = input("Do you wanna filter by own parameters? (y = yes, n = no): ")
-                            if own_parameters_input == "y":
-                                own_parameters = input("Type your filter parameters separated by commas (,): ")
-                                own_parameters = own_parameters.replace(" ", "")  # Remove any spaces in the input
-                                parameters = own_parameters.split(",")  # Split the input at each comma
-
-                                if strict_parameters is None:
-                                    while True:
-                                        strict_parameters_input = input("Do you wanna filter by strictly all "
-                                                                        "parameters? (y = yes, n = no): ")
-                                        if strict_parameters_input == "y":
-                                            strict_parameters = True
-                                            break
-                                        elif strict_parameters_input == "n":
-                                            strict_parameters = False
-                                            break
-                                        invalid_input()
-                                break
-                            elif own_parameters_input == "n":
-                                parameters = None
-                                break
-                            invalid_input()
-                    if split_words is None:
-                        while True:
-                            split_words_input = input("Do you wanna split each word from existing images? (y = yes, "
-                                                      "n = no): ")
-                            if split_words_input == "y":
-                                split_words = True
-                                break
-                            elif split_words_input == "n":
-                                split_words = False
-                                break
-                            invalid_input()
-                        break
                 invalid_input()
-            break
 
-if mode in [2, 4, 6, 7, 9, 10, 11, 12, 13, 14, 15]:
-    if model_type is None:
-        while True:
-            model_type = input("Which Scoring Model do you wanna use?\n1 = Xception\n2 = VGG16\n3 = VGG19\n4 = "
-                               "ResNet50\n5 = ResNet50V2\n6 = ResNet101\n7 = ResNet101V2\n8 = ResNet152\n9 = "
-                               "ResNet152V2\n10 = InceptionV3\n11 = InceptionResNetV2\n12 = MobileNet\13 = "
-                               "MobileNetV2\n14 = DenseNet121\n15 = DenseNet169\n16 = DenseNet201\n17 = "
-                               "NASNetMobile\n18 = NASNetLarge\n19 = EfficientNetB0\n20 = EfficientNetB1\n21 = "
-                               "EfficientNetB2\n22 = EfficientNetB3\n23 = EfficientNetB4\n24 = EfficientNetB5\n25 = "
-                               "EfficientNetB6\n26 = EfficientNetB7\n27 = EfficientNetV2B0\n28 = EfficientNetV2B1\n29 "
-                               "= EfficientNetV2B2\n30 = EfficientNetV2B3\n31 = EfficientNetV2S\n32 = "
-                               "EfficientNetV2M\n33 = EfficientNetV2L\n34 = ConvNeXtTiny\n35 = ConvNeXtSmall\n36 = "
-                               "ConvNeXtBase\n37 = ConvNeXtLarge\n38 = ConvNeXtXLarge\nSelected Scoring Model: ")
-
-            if model_type in [str(i) for i in range(1, 39)]:
-                model_type = int(model_type)
-                break
-            invalid_input()
+        # Every image is scored by each selected model, each model adds one folder level
+        model_types = model_type if isinstance(model_type, list) else [model_type]
+        score_range_types = {}
+        for score_model_type in model_types:
+            if score_model_type in SMALL_SCORE_MODELS:
+                score_range_types[score_model_type] = SCORE_RANGES_SMALL
+            elif score_model_type in BIG_SCORE_MODELS:
+                score_range_types[score_model_type] = SCORE_RANGES_BIG
+            else:
+                exit("Error 3")
 
-    if score_or_class is None:
-        while True:
-            score_or_class = input("Do you wanna filter by score or class? (s = score, c = class) ")
-            if score_or_class == "s" or score_or_class == "c":
-                break
-            invalid_input()
+    # Define input directory
+    if input_folder is None:
+        input_folder = get_folder_path("Choose your input folder")
 
-    print("Loading scoring model...")
-    model = MODEL_SELECTION[int(model_type)](weights='imagenet')
-    if model_type in SMALL_SCORE_MODELS:
-        score_range_type = SCORE_RANGES_SMALL
-    elif model_type in BIG_SCORE_MODELS:
-        score_range_type = SCORE_RANGES_BIG
-    else:
-        exit("Error 3")
+    # Define output directory
+    if output_folder is None:
+        output_folder = get_folder_path("Choose your output folder")
 
-# Define input directory
-if input_folder is None:
-    input_folder = get_folder_path("Choose your input folder")
+    if mode != 16:
+        if move_or_copy is None:
+            while True:
+                move_or_copy = input("Do you wanna move or copy the files?\n1 = Move\n2 = Copy\nSelected mode: ")
 
-# Define output directory
-if output_folder is None:
-    output_folder = get_folder_path("Choose your output folder")
+                if move_or_copy == "1" or move_or_copy == "2":
+                    move_or_copy = int(move_or_copy)
+                    break
 
-if mode != 16:
-    if move_or_copy is None:
-        while True:
-            move_or_copy = input("Do you wanna move or copy the files?\n1 = Move\n2 = Copy\nSelected mode: ")
+                invalid_input()
 
-            if move_or_copy == "1" or move_or_copy == "2":
-                move_or_copy = int(move_or_copy)
+    if batch_size is None:
+        batch_size = DEFAULT_BATCH_SIZE
+    if prefetch_workers is None:
+        prefetch_workers = DEFAULT_PREFETCH_WORKERS
+    if prefetch_depth is None:
+        prefetch_depth = DEFAULT_PREFETCH_DEPTH
+    if file_workers is None:
+        file_workers = DEFAULT_FILE_WORKERS
+    if file_queue_depth is None:
+        file_queue_depth = DEFAULT_FILE_QUEUE_DEPTH
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    if result_cache_size is None:
+        result_cache_size = DEFAULT_RESULT_CACHE_SIZE
+    if use_journal is None:
+        use_journal = DEFAULT_USE_JOURNAL
+    if journal_flush_every is None:
+        journal_flush_every = DEFAULT_JOURNAL_FLUSH_EVERY
+    if daemon is None:
+        daemon = DEFAULT_DAEMON
+    if daemon_settle_time is None:
+        daemon_settle_time = DEFAULT_DAEMON_SETTLE_TIME
+    if daemon_batch_wait is None:
+        daemon_batch_wait = DEFAULT_DAEMON_BATCH_WAIT
+    if inference_backend is None:
+        inference_backend = DEFAULT_INFERENCE_BACKEND
+    if quantize is None:
+        quantize = DEFAULT_QUANTIZE
+    if model_cache_folder is None:
+        model_cache_folder = DEFAULT_MODEL_CACHE_FOLDER
+    if dry_run is None:
+        dry_run = DEFAULT_DRY_RUN
+    if link_mode is None:
+        link_mode = DEFAULT_LINK_MODE
+    if verify_moves is None:
+        verify_moves = DEFAULT_VERIFY_MOVES
+    if analysis_only is None:
+        analysis_only = DEFAULT_ANALYSIS_ONLY
+
+    if autonomous != "True":
+        while True:
+            save_config = input("Do you wanna save current settings for next time? (y = yes, n = no) ")
+            if save_config == "y" or save_config == "n":
                 break
 
             invalid_input()
 
-if autonomous != "True":
-    while True:
-        save_config = input("Do you wanna save current settings for next time? (y = yes, n = no) ")
-        if save_config == "y" or save_config == "n":
-            break
-
-        invalid_input()
+        if save_config == "y":
+            data = {
+                "autonomous": autonomous,
+                "input_folder": input_folder,
+                "output_folder": output_folder,
+                "move_or_copy": move_or_copy,
+                "mode": mode,
+                "experimental": experimental,
+                "own_parameters": own_parameters,
+                "parameters": [
+                    parameters
+                ],
+                "strict_parameters": strict_parameters,
+                "split_words": split_words,
+                "model_type": model_type,
+                "score_or_class": score_or_class,
+                "batch_size": batch_size,
+                "prefetch_workers": prefetch_workers,
+                "prefetch_depth": prefetch_depth,
+                "file_workers": file_workers,
+                "file_queue_depth": file_queue_depth,
+                "workers": workers,
+                "result_cache": result_cache,
+                "result_cache_size": result_cache_size,
+                "journal": use_journal,
+                "journal_flush_every": journal_flush_every,
+                "daemon": daemon,
+                "daemon_settle_time": daemon_settle_time,
+                "daemon_batch_wait": daemon_batch_wait,
+                "inference_backend": inference_backend,
+                "quantize": quantize,
+                "model_cache_folder": model_cache_folder,
+                "dry_run": dry_run,
+                "plan_file": plan_file,
+                "link_mode": link_mode,
+                "verify_moves": verify_moves,
+                "tag_index": tag_index,
+                "manifest": manifest,
+                "analysis_only": analysis_only
+            }
+
+            with open('nsfw-score-and-model-filter_config.json', 'w') as file:
+                json.dump(data, file, indent=4)
+
+    # Count the total number of images in the input folder, the daemon finds them through the watcher
+    valid_extensions = ('.png', '.jpg', '.jpeg')
+    if daemon == "y":
+        image_files = []
+    else:
+        image_files = [file_path for file_path in input_folder.rglob('*')
+                       if file_path.suffix.lower() in valid_extensions]
 
-    if save_config == "y":
-        data = {
-            "autonomous": autonomous,
-            "input_folder": input_folder,
-            "output_folder": output_folder,
-            "move_or_copy": move_or_copy,
+    # Images finished by an interrupted run with the same settings are skipped, a dry run finishes nothing
+    processing_journal = None
+    if use_journal == "y" and dry_run == "n":
+        run_settings = {
             "mode": mode,
-            "experimental": experimental,
-            "own_parameters": own_parameters,
-            "parameters": [
-                parameters
-            ],
+            "input_folder": str(input_folder),
+            "move_or_copy": move_or_copy,
+            "model_type": model_type,
+            "score_or_class": score_or_class,
+            "parameters": parameters,
             "strict_parameters": strict_parameters,
             "split_words": split_words,
-            "model_type": model_type,
-            "score_or_class": score_or_class
-        }
-
-        with open('nsfw-score-and-model-filter_config.json', 'w') as file:
-            json.dump(data, file, indent=4)
-
-# Count the total number of images in the input folder
-valid_extensions = ('.png', '.jpg', '.jpeg')
-image_files = [file_path for file_path in input_folder.rglob('*') if file_path.suffix.lower() in valid_extensions]
-total_images = len(image_files)
-
-for idx, file_path in enumerate(image_files):
-    # Check if the file is a valid image
-    if file_path.suffix.lower() in valid_extensions:
-        print(f"\nAnalyzing image {idx + 1}/{total_images}\n{file_path.name}")
-        if mode in [1, 4, 5, 6, 8, 10, 11, 12, 13, 14, 15]:
-            # Check if the image is NSFW
-            nsfw_probability = is_nsfw(file_path)
-            print(f"NSFW probability: {nsfw_probability}")
-            nsfw_folder_name = get_folder_name(nsfw_probability, NSFW_RANGES)
-            nsfw_folder_name = "X" + nsfw_folder_name
-
-        if mode in [2, 4, 6, 7, 9, 10, 11, 12, 13, 14, 15]:
-            # Get the score and index for the input image
-            class_index, score = get_image_score(file_path)
-            print(f"Score: {score}, Class: {class_index}")
-            if score_or_class == "s":
-                score_folder_name = get_folder_name(score, score_range_type)
-                score_folder_name = "S" + score_folder_name
-            elif score_or_class == "c":
-                score_folder_name = "C" + class_index
-
-        if mode in [3, 5, 7, 8, 9, 10, 11, 12, 13, 14, 15]:
-            # Extract the model name
-            model_name = extract_model_name(file_path)
-            print(f"Model: {model_name}")
-            model_folder_name = model_name
-
-        if mode in [16]:
-            parameter_list = extract_parameters(file_path)
-            print(f"Parameters: {parameter_list}")
-
-        mode_folders = {
-            1: [nsfw_folder_name],
-            2: [score_folder_name],
-            3: [model_folder_name],
-            4: [nsfw_folder_name, score_folder_name],
-            5: [nsfw_folder_name, model_folder_name],
-            6: [score_folder_name, nsfw_folder_name],
-            7: [score_folder_name, model_folder_name],
-            8: [model_folder_name, nsfw_folder_name],
-            9: [model_folder_name, score_folder_name],
-            10: [nsfw_folder_name, score_folder_name, model_folder_name],
-            11: [nsfw_folder_name, model_folder_name, score_folder_name],
-            12: [score_folder_name, nsfw_folder_name, model_folder_name],
-            13: [score_folder_name, model_folder_name, nsfw_folder_name],
-            14: [model_folder_name, nsfw_folder_name, score_folder_name],
-            15: [model_folder_name, score_folder_name, nsfw_folder_name],
+            # An analysis-only run finishes images without moving them, a real sort mustn't resume from it
+            "analysis_only": analysis_only,
+            "link_mode": link_mode,
         }
+        processing_journal = ProcessingJournal(output_folder / JOURNAL_FILE_NAME, run_settings, journal_flush_every)
+        remaining_files = [file_path for file_path in image_files if not processing_journal.is_completed(file_path)]
+        if len(remaining_files) < len(image_files):
+            print(f"Resuming interrupted run, {len(image_files) - len(remaining_files)} images were already processed.")
+        image_files = remaining_files
+
+    total_images = len(image_files)
+
+    if mode not in [16] and move_or_copy not in [1, 2] and analysis_only == "n":
+        exit("Error 4")
+
+    # The routing plan is executed batch by batch, the moves/copies run in the background while the next
+    # batches are analyzed
+    file_operations = FileOperationExecutor(file_workers, file_queue_depth, dry_run == "y", plan_file, link_mode,
+                                            verify_moves)
+    plan = []
+
+    # The raw results of every image, see results_manifest.py for queries
+    results_manifest = ResultsManifest(manifest) if manifest is not None else None
+
+    # Parameter filtering adds the prompt tokens of every image to the tag index, see tag_index.py
+    parameter_index = None
+    if mode in PARAMETER_MODES and tag_index is not None:
+        parameter_index = TagIndex(tag_index, split_words in [True, "y"])
+
+    # The models are loaded once per process, the routing and file operations stay in this process
+    analyzer_settings = {
+        "mode": mode,
+        "model_type": model_type,
+        "split_words": split_words,
+        "batch_size": batch_size,
+        "prefetch_workers": prefetch_workers,
+        "prefetch_depth": prefetch_depth,
+        "result_cache": result_cache,
+        "result_cache_size": result_cache_size,
+        "inference_backend": inference_backend,
+        "quantize": quantize == "y",
+        "model_cache_folder": model_cache_folder,
+    }
+    analyzer = None
+    watcher = None
+    if daemon == "y":
+        # The models stay loaded while new images are picked up from the input folder
+        if workers > 1:
+            print("Daemon mode analyzes the images in this process, the workers setting is ignored.")
+        analyzer = ImageAnalyzer(**analyzer_settings)
+        watcher = FolderWatcher(input_folder, valid_extensions, output_folder, daemon_settle_time)
+        results = watch_results(analyzer, watcher)
+    elif workers > 1:
+        print(f"Analyzing images in {workers} worker processes...")
+        results = analyze_files_in_workers(image_files, workers, analyzer_settings)
+    else:
+        analyzer = ImageAnalyzer(**analyzer_settings)
+        results = analyzer.analyze_files(image_files)
 
-        if mode in mode_folders:
-            new_output_folder = output_folder
-            for folder_name in mode_folders[mode]:
-                new_output_folder = new_output_folder / folder_name
-                new_output_folder.mkdir(parents=True, exist_ok=True)
-            destination_file_path = new_output_folder / file_path.name
-            if not destination_file_path.exists():
-                if move_or_copy == 1:
-                    print(f"Image: {file_path.name} -> Move to folder: {new_output_folder}")
-                    shutil.move(file_path, destination_file_path)
-                    print(f"Moved image to {destination_file_path}")
-                elif move_or_copy == 2:
-                    print(f"Image: {file_path.name} -> Copy to folder: {new_output_folder}")
-                    shutil.copy(file_path, destination_file_path)
-                    print(f"Copied image to {destination_file_path}")
+    finished = False
+    try:
+        for idx, (file_path, result) in enumerate(results):
+            # Check if the file is a valid image
+            if file_path.suffix.lower() in valid_extensions:
+                if daemon == "y":
+                    print_line(f"\nAnalyzing new image {idx + 1}\n{file_path.name}")
                 else:
-                    exit("Error 4")
-            else:
-                print(f"Skipped image '{file_path.name}' as it already exists in the destination folder.")
-
-        elif mode == 16:
-            if strict_parameters:
-                parameters_found = True
-                for parameter in parameters:
-                    if parameter not in parameter_list:
-                        parameters_found = False
-                        break
+                    print_line(f"\nAnalyzing image {idx + 1}/{total_images}\n{file_path.name}")
+                if result is None:
+                    print_line(f"Skipped image '{file_path.name}' as it could not be analyzed.")
+                    continue
+
+                if mode in NSFW_MODES:
+                    # Check if the image is NSFW
+                    nsfw_probability = result.nsfw_probability
+                    print_line(f"NSFW probability: {nsfw_probability}")
+                    nsfw_folder_name = get_folder_name(nsfw_probability, NSFW_RANGES)
+                    nsfw_folder_name = "X" + nsfw_folder_name
+
+                if mode in SCORE_MODES:
+                    # Get the score and index for the input image from every model
+                    score_folder_name = Path()
+                    for score_model_type in model_types:
+                        top_k = result.model_scores[score_model_type]
+                        class_index, score = top_k[0] if top_k else (None, None)
+                        if score_or_class == "s":
+                            level_name = "S" + get_folder_name(score, score_range_types[score_model_type])
+                        else:
+                            level_name = f"C{class_index}"
+                        if len(model_types) > 1:
+                            model_name = get_model_name(score_model_type)
+                            print_line(f"{model_name} score: {score}, Class: {class_index}")
+                            level_name = f"{model_name}_{level_name}"
+                        else:
+                            print_line(f"Score: {score}, Class: {class_index}")
+                        score_folder_name = score_folder_name / level_name
+
+                if mode in MODEL_MODES:
+                    # Extract the model name
+                    model_name = result.model_name
+                    print_line(f"Model: {model_name}")
+                    model_folder_name = model_name
+
+                if mode in PARAMETER_MODES:
+                    parameter_list = result.parameter_list
+                    print_line(f"Parameters: {parameter_list}")
+                    if parameter_index is not None:
+                        stat = file_path.stat()
+                        parameter_index.add(file_path.resolve(), stat.st_size, stat.st_mtime_ns, parameter_list)
+
+                mode_folders = {
+                    1: [nsfw_folder_name],
+                    2: [score_folder_name],
+                    3: [model_folder_name],
+                    4: [nsfw_folder_name, score_folder_name],
+                    5: [nsfw_folder_name, model_folder_name],
+                    6: [score_folder_name, nsfw_folder_name],
+                    7: [score_folder_name, model_folder_name],
+                    8: [model_folder_name, nsfw_folder_name],
+                    9: [model_folder_name, score_folder_name],
+                    10: [nsfw_folder_name, score_folder_name, model_folder_name],
+                    11: [nsfw_folder_name, model_folder_name, score_folder_name],
+                    12: [score_folder_name, nsfw_folder_name, model_folder_name],
+                    13: [score_folder_name, model_folder_name, nsfw_folder_name],
+                    14: [model_folder_name, nsfw_folder_name, score_folder_name],
+                    15: [model_folder_name, score_folder_name, nsfw_folder_name],
+                }
+
+                if results_manifest is not None:
+                    results_manifest.add(result)
+
+                # Analysis only keeps the images where they are, the plan entry still records them in the journal
+                destinations = []
+                if analysis_only == "y":
+                    print_line(f"Image: {file_path.name} -> Written to manifest")
+                elif mode in mode_folders:
+                    new_output_folder = output_folder
+                    for folder_name in mode_folders[mode]:
+                        new_output_folder = new_output_folder / folder_name
+                    destinations.append((new_output_folder, move_or_copy == 1))
+
+                elif mode == 16:
+                    if strict_parameters:
+                        parameters_found = True
+                        for parameter in parameters:
+                            if parameter not in parameter_list:
+                                parameters_found = False
+                                break
+
+                        if parameters_found:
+                            folder_name = "_".join(parameters)  # Concatenate parameters with underscores
+                            new_output_folder = output_folder / folder_name
+                            destinations.append((new_output_folder, False))
+                        elif not parameters_found:
+                            print_line("No Matching parameter(s) found. Skipping image")
+                        else:
+                            exit("Error 8")
+
+                    else:
+                        for parameter in parameter_list:
+                            if parameters is None or parameter in parameters:
+                                new_output_folder = output_folder / parameter
+                                destinations.append((new_output_folder, False))
 
-                if parameters_found:
-                    folder_name = "_".join(parameters)  # Concatenate parameters with underscores
-                    new_output_folder = output_folder / folder_name
-                    new_output_folder.mkdir(parents=True, exist_ok=True)
-                    destination_file_path = new_output_folder / file_path.name
-                    if not destination_file_path.exists():
-                        print(f"Image: {file_path.name} -> Move to folder: {new_output_folder}")
-                        shutil.copy(file_path, destination_file_path)
-                        print(f"Copied image to {destination_file_path}")
-                elif not parameters_found:
-                    print("No Matching parameter(s) found. Skipping image")
                 else:
-                    exit("Error 8")
+                    print_line("Invalid mode entered.")
 
+                # The daemon doesn't know when the next image arrives, so it runs the plan right away
+                plan.append((file_path, destinations))
+                if len(plan) >= batch_size or daemon == "y":
+                    run_plan(plan)
+                    plan = []
             else:
-                for parameter in parameter_list:
-                    if parameters is None or parameter in parameters:
-                        new_output_folder = output_folder / parameter
-                        new_output_folder.mkdir(parents=True, exist_ok=True)
-                        destination_file_path = new_output_folder / file_path.name
-                        if not destination_file_path.exists():
-                            print(f"Image: {file_path.name} -> Move to folder: {new_output_folder}")
-                            shutil.copy(file_path, destination_file_path)
-                            print(f"Copied image to {destination_file_path}")
-
-        else:
-            print("Invalid mode entered.")
-    else:
-        print(f"Skipping non-image file: {file_path.name}")
-
-print("Image analysis and sorting complete.")
-exit()
+                print_line(f"Skipping non-image file: {file_path.name}")
+        run_plan(plan)
+        finished = True
+    except KeyboardInterrupt:
+        if daemon != "y":
+            raise
+        print_line("Daemon stopped.")
+    finally:
+        # Wait for the remaining file operations, then write out the journal
+        if watcher is not None:
+            watcher.stop()
+        file_operations.shutdown()
+        if parameter_index is not None:
+            parameter_index.close()
+        if results_manifest is not None:
+            results_manifest.close()
+        if analyzer is not None:
+            analyzer.close()
+        if processing_journal is not None:
+            processing_journal.close(finished)
+
+    print("Image analysis and sorting complete.")
+    exit()
@@ -0,0 +1,85 @@
+import io
+import struct
+import zlib
+from PIL import Image, PngImagePlugin
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Size of the single buffered read, enough for the header and the A1111 parameters of a typical image
+HEADER_READ_SIZE = 64 * 1024
+
+
+def _decompress(data):
+    # Same limit as Pillow uses for compressed text chunks
+    decompressor = zlib.decompressobj()
+    text = decompressor.decompress(data, PngImagePlugin.MAX_TEXT_CHUNK)
+    if decompressor.unconsumed_tail:
+        raise ValueError("Decompressed text chunk is too large")
+    return text
+
+
+def _decode_text_chunk(chunk_type, data):
+    if chunk_type == b"tEXt":
+        key, value = data.split(b"\0", 1)
+        return key.decode("latin-1"), value.decode("latin-1", "replace")
+    if chunk_type == b"zTXt":
+        key, value = data.split(b"\0", 1)
+        if value[0] != 0:
+            raise ValueError(f"Unknown compression method {value[0]} in zTXt chunk")
+        return key.decode("latin-1"), _decompress(value[1:]).decode("latin-1", "replace")
+    if chunk_type == b"iTXt":
+        key, value = data.split(b"\0", 1)
+        compression_flag, compression_method, value = value[0], value[1], value[2:]
+        _language, _translated_key, value = value.split(b"\0", 2)
+        if compression_flag:
+            if compression_method != 0:
+                raise ValueError(f"Unknown compression method {compression_method} in iTXt chunk")
+            value = _decompress(value)
+        return key.decode("latin-1"), value.decode("utf-8")
+    return None, None
+
+
+def _walk_png_text_chunks(file):
+    text_chunks = {}
+    while True:
+        header = file.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack(">I4s", header)
+        # Text chunks written after the pixel data are not part of the header
+        if chunk_type in (b"IDAT", b"IEND"):
+            break
+        if chunk_type in (b"tEXt", b"zTXt", b"iTXt"):
+            data = file.read(length)
+            if len(data) < length:
+                raise ValueError(f"Truncated {chunk_type.decode()} chunk")
+            key, value = _decode_text_chunk(chunk_type, data)
+            text_chunks[key] = value
+            # Skip the CRC
+            file.seek(4, 1)
+        else:
+            file.seek(length + 4, 1)
+    return text_chunks
+
+
+def read_text_chunks(image_path, data=None):
+    """Return the text metadata of an image, equivalent to Image.open(image_path).info for the text keys.
+
+    PNG files are walked chunk by chunk up to the first IDAT without touching the pixel data,
+    everything else goes through Pillow. With data, the content already read, the file isn't opened.
+    """
+    with io.BytesIO(data) if data is not None else open(image_path, "rb", buffering=HEADER_READ_SIZE) as file:
+        if file.read(len(PNG_SIGNATURE)) == PNG_SIGNATURE:
+            try:
+                return _walk_png_text_chunks(file)
+            except (ValueError, IndexError, UnicodeDecodeError, zlib.error):
+                # Malformed chunks are left to Pillow, which reports them the usual way
+                pass
+
+    with Image.open(io.BytesIO(data) if data is not None else image_path) as img:
+        return dict(img.info)
+
+
+def read_parameters(image_path, data=None):
+    # The A1111 generation parameters are stored in the "parameters" text chunk
+    return read_text_chunks(image_path, data).get("parameters", "")
@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+import time
+
+
+class ProcessingJournal:
+    """Append-only record of the images a run has finished, so an interrupted run can resume.
+
+    Entries are buffered and written with a single fsync every flush_every entries or flush_interval
+    seconds. The journal is removed once the run completes.
+    """
+
+    def __init__(self, path, run_settings, flush_every=256, flush_interval=5.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.completed = set()
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+        if self._load(run_settings):
+            self.file = open(self.path, "a", encoding="utf-8")
+            # Terminate a line cut off by the interrupted run
+            if self._truncated:
+                self.file.write("\n")
+        else:
+            self.file = open(self.path, "w", encoding="utf-8")
+            self.file.write(json.dumps({"run": run_settings}) + "\n")
+            self._sync()
+
+    def _load(self, run_settings):
+        # Returns True if the existing journal belongs to an interrupted run with the same settings
+        if not os.path.exists(self.path):
+            return False
+
+        with open(self.path, "r", encoding="utf-8") as file:
+            lines = file.readlines()
+        self._truncated = bool(lines) and not lines[-1].endswith("\n")
+        try:
+            if json.loads(lines[0]).get("run") != run_settings:
+                print("Journal belongs to a run with other settings, starting from zero.")
+                return False
+        except (IndexError, ValueError):
+            return False
+
+        for line in lines[1:]:
+            try:
+                self.completed.add(json.loads(line)["source"])
+            except (ValueError, KeyError):
+                # The last line may be incomplete if the run died while writing it
+                continue
+        return True
+
+    def is_completed(self, file_path):
+        return str(file_path) in self.completed
+
+    def record(self, file_path, destinations):
+        entry = {"source": str(file_path), "destinations": [str(destination) for destination in destinations]}
+        with self._lock:
+            self.completed.add(entry["source"])
+            self._buffer.append(json.dumps(entry) + "\n")
+            if len(self._buffer) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self.file.write("".join(self._buffer))
+            self._buffer = []
+            self._sync()
+        self._last_flush = time.monotonic()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self, finished=False):
+        with self._lock:
+            self._flush()
+            self.file.close()
+        # A finished run has nothing left to resume
+        if finished:
+            os.remove(self.path)
@@ -0,0 +1,116 @@
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+
+class ResultCache:
+    """Persistent cache of model outputs keyed by the SHA256 of the file content and the model id.
+
+    Entries written by another version of a model are dropped when that model is registered.
+    Reads and writes are kept in memory until commit(), so each batch costs a single transaction.
+    """
+
+    def __init__(self, path, max_entries=1000000):
+        self.max_entries = max_entries
+        self.versions = {}
+        self._lock = threading.Lock()
+        self._pending_writes = []
+        self._pending_touches = []
+
+        # Several worker processes may share the cache, WAL lets them read while one of them writes
+        self.conn = sqlite3.connect(str(path), timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                content_hash TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                model_version TEXT NOT NULL,
+                value TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (content_hash, model_id)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.conn.commit()
+
+    def register_model(self, model_id, model_version):
+        # Entries computed by a different version of the model are no longer valid
+        with self._lock:
+            self.versions[model_id] = model_version
+            self.conn.execute("DELETE FROM results WHERE model_id = ? AND model_version != ?",
+                              (model_id, model_version))
+            self.conn.commit()
+
+    def get(self, content_hash, model_id):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value FROM results WHERE content_hash = ? AND model_id = ? AND model_version = ?",
+                (content_hash, model_id, self.versions[model_id]),
+            ).fetchone()
+            if row is None:
+                return None
+            self._pending_touches.append((time.time(), content_hash, model_id))
+            return json.loads(row[0])
+
+    def put(self, content_hash, model_id, value):
+        with self._lock:
+            self._pending_writes.append(
+                (content_hash, model_id, self.versions[model_id], json.dumps(value), time.time())
+            )
+
+    def commit(self):
+        with self._lock:
+            if not self._pending_writes and not self._pending_touches:
+                return
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO results (content_hash, model_id, model_version, value, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    self._pending_writes,
+                )
+                self.conn.executemany(
+                    "UPDATE results SET last_used = ? WHERE content_hash = ? AND model_id = ?",
+                    self._pending_touches,
+                )
+            self._pending_writes = []
+            self._pending_touches = []
+
+    def evict(self):
+        # Drop the least recently used entries above the size cap
+        with self._lock:
+            count = self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            if count > self.max_entries:
+                with self.conn:
+                    self.conn.execute(
+                        "DELETE FROM results WHERE rowid IN "
+                        "(SELECT rowid FROM results ORDER BY last_used ASC LIMIT ?)",
+                        (count - self.max_entries,),
+                    )
+                print(f"Evicted {count - self.max_entries} entries from the result cache.")
+
+    def invalidate(self, model_id=None):
+        with self._lock:
+            with self.conn:
+                if model_id is None:
+                    deleted = self.conn.execute("DELETE FROM results").rowcount
+                else:
+                    deleted = self.conn.execute("DELETE FROM results WHERE model_id = ?", (model_id,)).rowcount
+            return deleted
+
+    def close(self):
+        self.commit()
+        self.evict()
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    # Usage: python result_cache.py <cache file> [model id]
+    # Removes the entries of one model, or every entry when no model id is given
+    if len(sys.argv) not in [2, 3]:
+        exit("Usage: python result_cache.py <cache file> [model id]")
+    cache = ResultCache(sys.argv[1])
+    removed = cache.invalidate(sys.argv[2] if len(sys.argv) == 3 else None)
+    cache.close()
+    print(f"Removed {removed} entries from the result cache.")
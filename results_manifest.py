@@ -0,0 +1,177 @@
+import json
+import re
+import sqlite3
+import sys
+import threading
+from collections import Counter
+from pathlib import Path
+from buckets import NSFW_RANGES, get_folder_name, get_score_ranges
+
+# Conditions of the filter command: nsfw>=0.9, score:13<0.5, class:13=281, model=name
+CONDITION_PATTERN = re.compile(r"^(nsfw|score:\d+|class:\d+|model)(>=|<=|!=|=|>|<)(.+)$")
+
+
+class ResultsManifest:
+    """Raw analysis results per image, so other ranges can be tried without running the models again.
+
+    Rows are kept in memory until commit(), images analyzed again replace their old rows. Moved images are
+    recorded at their destination.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                path TEXT PRIMARY KEY,
+                nsfw_probability REAL,
+                model_name TEXT
+            )
+        """)
+        # One row per image and scoring model
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS scores (
+                path TEXT NOT NULL,
+                model_type INTEGER NOT NULL,
+                class_index INTEGER,
+                score REAL,
+                PRIMARY KEY (path, model_type)
+            )
+        """)
+        self.conn.commit()
+        self._pending_images = []
+        self._pending_scores = []
+        # Moves finished by the file operation threads, applied by the next commit()
+        self._pending_moves = []
+        self._moves_lock = threading.Lock()
+
+    def add(self, result):
+        path = str(result.path)
+        self._pending_images.append((path, result.nsfw_probability, result.model_name))
+        for model_type, top_k in (result.model_scores or {}).items():
+            class_index, score = top_k[0] if top_k else (None, None)
+            self._pending_scores.append((path, model_type, class_index, score))
+
+    def move(self, path, destination_path):
+        # Called once the image at path was moved, may run in any thread
+        with self._moves_lock:
+            self._pending_moves.append((str(destination_path), str(path)))
+
+    def commit(self):
+        with self._moves_lock:
+            moves, self._pending_moves = self._pending_moves, []
+        if not self._pending_images and not moves:
+            return
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO images (path, nsfw_probability, model_name) VALUES (?, ?, ?)",
+                                  self._pending_images)
+            self.conn.executemany("INSERT OR REPLACE INTO scores (path, model_type, class_index, score) "
+                                  "VALUES (?, ?, ?, ?)", self._pending_scores)
+            self.conn.executemany("UPDATE OR REPLACE images SET path = ? WHERE path = ?", moves)
+            self.conn.executemany("UPDATE OR REPLACE scores SET path = ? WHERE path = ?", moves)
+        self._pending_images = []
+        self._pending_scores = []
+
+    def values(self, field, model_type=None):
+        # (path, value) of every image for "nsfw", "model", "score" or "class"
+        if field == "nsfw":
+            return self.conn.execute("SELECT path, nsfw_probability FROM images").fetchall()
+        if field == "model":
+            return self.conn.execute("SELECT path, model_name FROM images").fetchall()
+        column = "score" if field == "score" else "class_index"
+        return self.conn.execute(f"SELECT path, {column} FROM scores WHERE model_type = ?", (model_type,)).fetchall()
+
+    def buckets(self, field, ranges=None, model_type=None):
+        # Folder name of every image with the given ranges, the folder ranges of the filter by default
+        if field == "nsfw":
+            ranges = ranges or NSFW_RANGES
+            return [(path, "X" + get_folder_name(value, ranges)) for path, value in self.values(field)]
+        if field == "score":
+            ranges = ranges or get_score_ranges(model_type)
+            return [(path, "S" + get_folder_name(value, ranges)) for path, value in self.values(field, model_type)]
+        if field == "class":
+            return [(path, f"C{value}") for path, value in self.values(field, model_type)]
+        return [(path, str(value)) for path, value in self.values(field)]
+
+    def filter(self, conditions):
+        # Paths of the images matching every condition, e.g. ["nsfw>=0.9", "score:13<0.5"]
+        matches = None
+        for condition in conditions:
+            match = CONDITION_PATTERN.match(condition)
+            if match is None:
+                raise ValueError(f"Invalid condition '{condition}'")
+            target, operator, expected = match.groups()
+            field, _, model_type = target.partition(":")
+            if field in ["nsfw", "score", "class"]:
+                expected = float(expected)
+            compare = {
+                ">=": lambda value: value >= expected,
+                "<=": lambda value: value <= expected,
+                ">": lambda value: value > expected,
+                "<": lambda value: value < expected,
+                "=": lambda value: value == expected,
+                "!=": lambda value: value != expected,
+            }[operator]
+            paths = {path for path, value in self.values(field, int(model_type) if model_type else None)
+                     if value is not None and compare(value)}
+            matches = paths if matches is None else matches & paths
+        return sorted(matches or [])
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def _field_arguments(arguments):
+    # "nsfw", "model", "score:13" or "class:13", optionally followed by ranges as JSON or "default"
+    field, _, model_type = arguments[0].partition(":")
+    if field not in ["nsfw", "model", "score", "class"] or (field in ["score", "class"]) != bool(model_type):
+        exit(f"Invalid field '{arguments[0]}'")
+    ranges = None
+    if len(arguments) > 1 and arguments[1] != "default":
+        ranges = [tuple(bounds) for bounds in json.loads(arguments[1])]
+    return field, ranges, int(model_type) if model_type else None
+
+
+if __name__ == "__main__":
+    # Usage: python results_manifest.py <manifest> histogram <field> [ranges]
+    #        python results_manifest.py <manifest> filter <condition> [<condition> ...]
+    #        python results_manifest.py <manifest> rebucket <field> [ranges] [output folder] [link mode]
+    # Fields are nsfw, model, score:<model type> and class:<model type>, ranges are JSON like "[[0, 0.5], [0.5, 1]]"
+    # or "default" for the ranges of the filter
+    usage = ("Usage: python results_manifest.py <manifest> histogram <field> [ranges]\n"
+             "       python results_manifest.py <manifest> filter <condition> [<condition> ...]\n"
+             "       python results_manifest.py <manifest> rebucket <field> [ranges] [output folder] [link mode]")
+    if len(sys.argv) < 4 or sys.argv[2] not in ["histogram", "filter", "rebucket"]:
+        exit(usage)
+
+    manifest = ResultsManifest(sys.argv[1])
+    command = sys.argv[2]
+    if command == "histogram":
+        field, ranges, model_type = _field_arguments(sys.argv[3:5])
+        histogram = Counter(bucket for _, bucket in manifest.buckets(field, ranges, model_type))
+        total = sum(histogram.values())
+        for bucket, count in sorted(histogram.items(), key=lambda item: (-item[1], item[0])):
+            print(f"{count:>8}  {count / total:>6.1%}  {bucket}")
+    elif command == "filter":
+        try:
+            matches = manifest.filter(sys.argv[3:])
+        except ValueError as e:
+            exit(str(e))
+        for path in matches:
+            print(path)
+        print(f"{len(matches)} matching images.")
+    else:
+        field, ranges, model_type = _field_arguments(sys.argv[3:5])
+        buckets = manifest.buckets(field, ranges, model_type)
+        if len(sys.argv) >= 6:
+            # Copy (or link) every image into the folder of its bucket
+            from file_operations import FileOperationExecutor
+            output_folder = Path(sys.argv[5])
+            file_operations = FileOperationExecutor(link_mode=sys.argv[6] if len(sys.argv) == 7 else "copy")
+            file_operations.execute([(Path(path), [(output_folder / bucket, False)]) for path, bucket in buckets])
+            file_operations.shutdown()
+        else:
+            for path, bucket in buckets:
+                print(f"{bucket}  {path}")
+    manifest.close()
@@ -0,0 +1,88 @@
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+# Usage: python startup-benchmark.py [runs]
+# Times the startup of the filter in fresh interpreters: the old eager imports against the lazy
+# model registry, for a metadata-only mode and for a scoring mode
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+# Imports and Qt setup every script did at startup before the model registry
+EAGER_STARTUP = """
+import opennsfw2
+from tensorflow.keras.applications import (Xception, VGG16, VGG19, ResNet50, ResNet50V2, ResNet101, ResNet101V2,
+                                           ResNet152, ResNet152V2, InceptionV3, InceptionResNetV2, MobileNet,
+                                           MobileNetV2, DenseNet121, DenseNet169, DenseNet201, NASNetMobile,
+                                           NASNetLarge, EfficientNetB0, EfficientNetB1, EfficientNetB2, EfficientNetB3,
+                                           EfficientNetB4, EfficientNetB5, EfficientNetB6, EfficientNetB7,
+                                           EfficientNetV2B0, EfficientNetV2B1, EfficientNetV2B2, EfficientNetV2B3,
+                                           EfficientNetV2S, EfficientNetV2M, EfficientNetV2L, ConvNeXtTiny,
+                                           ConvNeXtSmall, ConvNeXtBase, ConvNeXtLarge, ConvNeXtXLarge)
+from tensorflow.keras.applications.xception import preprocess_input
+from tensorflow.keras.applications.resnet import preprocess_input
+from tensorflow.keras.applications.resnet_v2 import preprocess_input
+from tensorflow.keras.applications.vgg16 import preprocess_input
+from tensorflow.keras.applications.vgg19 import preprocess_input
+from tensorflow.keras.applications.densenet import preprocess_input
+from tensorflow.keras.applications.inception_v3 import preprocess_input
+from tensorflow.keras.applications.inception_resnet_v2 import preprocess_input
+from tensorflow.keras.applications.mobilenet import preprocess_input
+from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
+from tensorflow.keras.applications.nasnet import preprocess_input
+from tensorflow.keras.applications.efficientnet import preprocess_input
+from tensorflow.keras.applications.efficientnet_v2 import preprocess_input
+from tensorflow.keras.applications.convnext import preprocess_input
+from PyQt5.QtWidgets import QApplication
+app = QApplication([])
+"""
+
+# Mode 3 (model filtering) only reads the metadata
+LAZY_METADATA_STARTUP = """
+import sys
+import image_analysis
+analyzer = image_analysis.ImageAnalyzer(mode=3)
+assert "tensorflow" not in sys.modules and "PyQt5" not in sys.modules
+"""
+
+# Mode 2 (score filtering) with MobileNetV2, the weights are not loaded
+LAZY_SCORE_STARTUP = """
+import image_analysis
+from model_registry import load_model_class, load_preprocess_input
+load_model_class(13)
+load_preprocess_input(13)
+"""
+
+SCENARIOS = [
+    ("eager imports + QApplication", EAGER_STARTUP),
+    ("lazy, metadata mode", LAZY_METADATA_STARTUP),
+    ("lazy, score mode", LAZY_SCORE_STARTUP),
+]
+
+
+def time_startup(code):
+    # Each scenario runs in a fresh interpreter, so nothing is already imported
+    environment = dict(os.environ, QT_QPA_PLATFORM="offscreen", TF_CPP_MIN_LOG_LEVEL="3")
+    wrapped = "import time\nstart = time.perf_counter()\n" + code + "\nprint(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", wrapped], cwd=Path(__file__).parent, env=environment,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return None, result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "failed"
+    return float(result.stdout.strip().splitlines()[-1]), None
+
+
+for name, code in SCENARIOS:
+    times = []
+    error = None
+    for _ in range(RUNS):
+        elapsed, error = time_startup(code)
+        if elapsed is None:
+            break
+        times.append(elapsed)
+
+    if error is not None:
+        print(f"{name:<32} not available: {error}")
+    else:
+        print(f"{name:<32} median {statistics.median(times):.2f}s, min {min(times):.2f}s over {RUNS} runs")
@@ -0,0 +1,56 @@
+import sqlite3
+
+
+class StatCache:
+    """Last SHA256 of every file, valid as long as its size, modification time and inode are the same.
+
+    The whole cache is loaded into memory, so a lookup never touches the file or the database. New entries
+    are kept in memory until commit().
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            )
+        """)
+        self.conn.commit()
+        self.entries = {}
+        for path, size, mtime_ns, inode, sha256 in self.conn.execute("SELECT * FROM files"):
+            self.entries[path] = (size, mtime_ns, inode, sha256)
+        self._pending = []
+
+    def get(self, path, stat):
+        # The SHA256 of the file if it didn't change since it was hashed, else None
+        entry = self.entries.get(str(path))
+        if entry is None or entry[:3] != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            return None
+        return entry[3]
+
+    def put(self, path, stat, sha256):
+        entry = (stat.st_size, stat.st_mtime_ns, stat.st_ino, sha256)
+        if self.entries.get(str(path)) != entry:
+            self.entries[str(path)] = entry
+            self._pending.append((str(path),) + entry)
+            if len(self._pending) >= 10000:
+                self.commit()
+
+    def commit(self):
+        if not self._pending:
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, inode, sha256) VALUES (?, ?, ?, ?, ?)",
+                self._pending,
+            )
+        self._pending = []
+
+    def close(self):
+        self.commit()
+        self.conn.close()
@@ -0,0 +1,312 @@
+import json
+import os
+import re
+import sqlite3
+import sys
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+import numpy as np
+from image_analysis import tokenize_parameters
+from png_metadata import read_parameters
+
+# Query syntax: tokens combined with AND, OR, NOT and parentheses, tokens containing spaces in double quotes
+QUERY_PATTERN = re.compile(r'\(|\)|"[^"]*"|[^\s()]+')
+
+
+def _to_blob(ids):
+    # Stored as little-endian unsigned 32-bit integers
+    if sys.byteorder == "big":
+        ids = array("I", ids)
+        ids.byteswap()
+    return ids.tobytes()
+
+
+def _from_blob(blob):
+    ids = array("I")
+    ids.frombytes(blob)
+    if sys.byteorder == "big":
+        ids.byteswap()
+    return ids
+
+
+def _insert_id(ids, image_id):
+    # New images get the highest id so far, so this is nearly always an append
+    if not ids or ids[-1] < image_id:
+        ids.append(image_id)
+        return
+    position = bisect_left(ids, image_id)
+    if position == len(ids) or ids[position] != image_id:
+        ids.insert(position, image_id)
+
+
+def _remove_id(ids, image_id):
+    position = bisect_left(ids, image_id)
+    if position < len(ids) and ids[position] == image_id:
+        del ids[position]
+
+
+def _intersect(left, right):
+    # Both sorted: every id of the shorter list is looked up in the longer one with a binary search
+    if len(left) > len(right):
+        left, right = right, left
+    if not len(left):
+        return left
+    positions = np.minimum(np.searchsorted(right, left), len(right) - 1)
+    return left[right[positions] == left]
+
+
+def _union(left, right):
+    # The stable sort finds the two sorted runs and merges them in linear time
+    merged = np.sort(np.concatenate((left, right)), kind="stable")
+    if not len(merged):
+        return merged
+    keep = np.empty(len(merged), dtype=bool)
+    keep[0] = True
+    np.not_equal(merged[1:], merged[:-1], out=keep[1:])
+    return merged[keep]
+
+
+def _difference(left, right):
+    # Ids of the sorted left list that are not in the sorted right list
+    if not len(left) or not len(right):
+        return left
+    positions = np.minimum(np.searchsorted(right, left), len(right) - 1)
+    return left[right[positions] != left]
+
+
+class TagIndex:
+    """Persistent inverted index from prompt token to the images whose prompt contains it.
+
+    Every image gets an integer id and every token a posting list: the sorted ids of its images in an
+    array('I'), 4 bytes per image, updated in place. Queries work on the sorted lists directly, without
+    copying them: AND looks the shorter list up in the longer one and AND NOT is a difference, so a query
+    only costs the length of its posting lists. The posting lists are stored in SQLite and kept in memory.
+    """
+
+    def __init__(self, path, split_words=None):
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                tokens TEXT NOT NULL
+            )
+        """)
+        # Indexes written before the posting lists were id arrays store bitmaps, those are rebuilt below
+        old_postings = "bitmap" in [column[1] for column in self.conn.execute("PRAGMA table_info(postings)")]
+        if old_postings:
+            self.conn.execute("DROP TABLE postings")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS postings (token TEXT PRIMARY KEY, ids BLOB NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.commit()
+
+        # Tokens split another way can't be mixed with the existing ones, None keeps the current setting
+        row = self.conn.execute("SELECT value FROM settings WHERE key = 'split_words'").fetchone()
+        if split_words is None:
+            split_words = json.loads(row[0]) if row is not None else False
+        self.split_words = split_words
+        if row is not None and json.loads(row[0]) != split_words:
+            print("Index was built with another split_words setting, rebuilding it.")
+            with self.conn:
+                self.conn.execute("DELETE FROM images")
+                self.conn.execute("DELETE FROM postings")
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('split_words', ?)",
+                              (json.dumps(split_words),))
+
+        self.postings = {}
+        for token, blob in self.conn.execute("SELECT token, ids FROM postings"):
+            self.postings[token] = _from_blob(blob)
+        self.images = {}
+        self.paths = {}
+        # Sorted ids of all images, the complement of a NOT without an AND
+        self.image_ids = array("I")
+        for image_id, path, size, mtime_ns in self.conn.execute(
+            "SELECT id, path, size, mtime_ns FROM images ORDER BY id"
+        ):
+            self.images[path] = (image_id, size, mtime_ns)
+            self.paths[image_id] = path
+            self.image_ids.append(image_id)
+        self._dirty_tokens = set()
+        if old_postings:
+            for image_id, tokens in self.conn.execute("SELECT id, tokens FROM images").fetchall():
+                self._set_tokens(image_id, [], json.loads(tokens))
+            self.commit()
+
+    def _set_tokens(self, image_id, old_tokens, new_tokens):
+        for token in set(old_tokens) - set(new_tokens):
+            _remove_id(self.postings[token], image_id)
+            self._dirty_tokens.add(token)
+        for token in set(new_tokens) - set(old_tokens):
+            if token not in self.postings:
+                self.postings[token] = array("I")
+            _insert_id(self.postings[token], image_id)
+            self._dirty_tokens.add(token)
+
+    def _old_tokens(self, image_id):
+        return json.loads(self.conn.execute("SELECT tokens FROM images WHERE id = ?", (image_id,)).fetchone()[0])
+
+    def add(self, file_path, size, mtime_ns, tokens):
+        path = str(file_path)
+        if path in self.images:
+            image_id = self.images[path][0]
+            self._set_tokens(image_id, self._old_tokens(image_id), tokens)
+            self.conn.execute("UPDATE images SET size = ?, mtime_ns = ?, tokens = ? WHERE id = ?",
+                              (size, mtime_ns, json.dumps(tokens), image_id))
+        else:
+            image_id = self.conn.execute("INSERT INTO images (path, size, mtime_ns, tokens) VALUES (?, ?, ?, ?)",
+                                         (path, size, mtime_ns, json.dumps(tokens))).lastrowid
+            self.paths[image_id] = path
+            _insert_id(self.image_ids, image_id)
+            self._set_tokens(image_id, [], tokens)
+        self.images[path] = (image_id, size, mtime_ns)
+
+    def remove(self, path):
+        image_id = self.images.pop(path)[0]
+        self._set_tokens(image_id, self._old_tokens(image_id), [])
+        self.conn.execute("DELETE FROM images WHERE id = ?", (image_id,))
+        del self.paths[image_id]
+        _remove_id(self.image_ids, image_id)
+
+    def build(self, folder, extensions=('.png', '.jpg', '.jpeg')):
+        # Incremental: only new and changed images are read, images that are gone are removed
+        folder = Path(folder).resolve()
+        seen = set()
+        added = 0
+        for file_path in folder.rglob('*'):
+            if file_path.suffix.lower() not in extensions:
+                continue
+            path = str(file_path)
+            seen.add(path)
+            stat = os.stat(file_path)
+            if path in self.images and self.images[path][1:] == (stat.st_size, stat.st_mtime_ns):
+                continue
+            try:
+                tokens = tokenize_parameters(read_parameters(file_path), self.split_words) or []
+            except OSError as e:
+                print(f"Skipping image '{file_path.name}' due to an error: {str(e)}")
+                continue
+            self.add(file_path, stat.st_size, stat.st_mtime_ns, tokens)
+            added += 1
+
+        removed = [path for path in self.images if path.startswith(str(folder) + os.sep) and path not in seen]
+        for path in removed:
+            self.remove(path)
+        self.commit()
+        print(f"Indexed {added} new or changed images, removed {len(removed)}, {len(self.images)} images in total.")
+
+    def commit(self):
+        with self.conn:
+            for token in self._dirty_tokens:
+                if self.postings[token]:
+                    self.conn.execute("INSERT OR REPLACE INTO postings (token, ids) VALUES (?, ?)",
+                                      (token, _to_blob(self.postings[token])))
+                else:
+                    del self.postings[token]
+                    self.conn.execute("DELETE FROM postings WHERE token = ?", (token,))
+        self._dirty_tokens = set()
+
+    def query(self, expression):
+        # Returns the paths of the matching images, e.g. for 'tag1 AND tag2 AND NOT tag3'
+        parts = [part.strip('"') if part.startswith('"') else part for part in QUERY_PATTERN.findall(expression)]
+        position, ids = self._parse_or(parts, 0)
+        if position != len(parts):
+            raise ValueError(f"Unexpected '{parts[position]}' in query")
+        return [self.paths[image_id] for image_id in ids.tolist()]
+
+    def _parse_or(self, parts, position):
+        position, ids = self._parse_and(parts, position)
+        while position < len(parts) and parts[position] == "OR":
+            position, right = self._parse_and(parts, position + 1)
+            ids = _union(ids, right)
+        return position, ids
+
+    def _parse_and(self, parts, position):
+        position, ids = self._parse_not(parts, position)
+        while position < len(parts) and parts[position] == "AND":
+            if position + 1 < len(parts) and parts[position + 1] == "NOT":
+                # AND NOT removes the ids instead of intersecting with the complement
+                position, right = self._parse_not(parts, position + 2)
+                ids = _difference(ids, right)
+            else:
+                position, right = self._parse_not(parts, position + 1)
+                ids = _intersect(ids, right)
+        return position, ids
+
+    def _parse_not(self, parts, position):
+        if position < len(parts) and parts[position] == "NOT":
+            position, ids = self._parse_not(parts, position + 1)
+            return position, _difference(self._ids(self.image_ids), ids)
+        return self._parse_term(parts, position)
+
+    def _ids(self, ids):
+        # The array as a NumPy array sharing its memory
+        return np.frombuffer(ids, dtype=np.uint32) if len(ids) else np.empty(0, dtype=np.uint32)
+
+    def _parse_term(self, parts, position):
+        if position >= len(parts):
+            raise ValueError("Query ends unexpectedly")
+        if parts[position] == "(":
+            position, ids = self._parse_or(parts, position + 1)
+            if position >= len(parts) or parts[position] != ")":
+                raise ValueError("Missing ')' in query")
+            return position + 1, ids
+        return position + 1, self._ids(self.postings.get(parts[position], ()))
+
+    def top_tokens(self, count=20):
+        # Most frequent tokens with the number of images containing them
+        frequencies = [(token, len(ids)) for token, ids in self.postings.items()]
+        return sorted(frequencies, key=lambda item: (-item[1], item[0]))[:count]
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    # Usage: python tag_index.py <index file> build <image folder> [split words y/n]
+    #        python tag_index.py <index file> query "<expression>" [output folder] [link mode]
+    #        python tag_index.py <index file> top [count]
+    usage = ("Usage: python tag_index.py <index file> build <image folder> [split words y/n]\n"
+             "       python tag_index.py <index file> query \"<expression>\" [output folder] [link mode]\n"
+             "       python tag_index.py <index file> top [count]")
+    if len(sys.argv) < 3 or sys.argv[2] not in ["build", "query", "top"]:
+        exit(usage)
+
+    command = sys.argv[2]
+    if command == "build":
+        if len(sys.argv) not in [4, 5]:
+            exit(usage)
+        # Without the split argument the index keeps the setting it was built with
+        index = TagIndex(sys.argv[1], sys.argv[4] == "y" if len(sys.argv) == 5 else None)
+        index.build(sys.argv[3])
+    else:
+        # Queries use the setting the index was built with
+        index = TagIndex(sys.argv[1])
+
+    if command == "query":
+        if len(sys.argv) not in [4, 5, 6]:
+            exit(usage)
+        try:
+            matches = index.query(sys.argv[3])
+        except ValueError as e:
+            index.close()
+            exit(f"Invalid query: {str(e)}")
+        if len(sys.argv) >= 5:
+            # Copy (or link) the matching images into the output folder
+            from file_operations import FileOperationExecutor
+            file_operations = FileOperationExecutor(link_mode=sys.argv[5] if len(sys.argv) == 6 else "copy")
+            file_operations.execute([(Path(path), [(Path(sys.argv[4]), False)]) for path in matches])
+            file_operations.shutdown()
+        else:
+            for path in matches:
+                print(path)
+        print(f"{len(matches)} matching images.")
+    elif command == "top":
+        for token, frequency in index.top_tokens(int(sys.argv[3]) if len(sys.argv) == 4 else 20):
+            print(f"{frequency:>8}  {token}")
+    index.close()
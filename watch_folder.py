@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from pathlib import Path
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# Seconds between two scans of the folder when watchdog is not installed
+POLL_INTERVAL = 5.0
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher.add_candidate(Path(event.src_path))
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.add_candidate(Path(event.src_path))
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.watcher.forget(Path(event.src_path))
+            self.watcher.add_candidate(Path(event.dest_path))
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.watcher.forget(Path(event.src_path))
+
+
+class FolderWatcher:
+    """Reports the image files written below a folder once their size and mtime stopped changing.
+
+    Uses native file system events (inotify on Linux) through watchdog when it is installed and
+    falls back to scanning the folder every POLL_INTERVAL seconds. Files already in the folder
+    when the watcher starts are reported as well.
+    """
+
+    def __init__(self, folder, extensions, exclude_folder=None, settle_time=2.0):
+        self.folder = Path(folder)
+        self.extensions = extensions
+        self.exclude_folder = Path(exclude_folder).resolve() if exclude_folder is not None else None
+        self.settle_time = settle_time
+
+        # Files waiting to settle, mapped to their last (size, mtime) and when it was first seen
+        self.candidates = {}
+        # Files already reported, so repeated events or scans don't report them twice
+        self.reported = set()
+        self._lock = threading.Lock()
+        self._last_poll = time.monotonic()
+
+        for file_path in self._scan():
+            self.add_candidate(file_path)
+
+        self.observer = None
+        if Observer is not None:
+            self.observer = Observer()
+            self.observer.schedule(_EventHandler(self), str(self.folder), recursive=True)
+            self.observer.start()
+            print(f"Watching {self.folder} for new images...")
+        else:
+            print(f"watchdog is not installed, scanning {self.folder} for new images every {POLL_INTERVAL} seconds...")
+
+    def _is_watched(self, file_path):
+        if file_path.suffix.lower() not in self.extensions:
+            return False
+        # Images sorted into an output folder inside the input folder must not be picked up again
+        if self.exclude_folder is not None and self.exclude_folder in file_path.resolve().parents:
+            return False
+        return True
+
+    def _scan(self):
+        return [file_path for file_path in self.folder.rglob('*') if self._is_watched(file_path)]
+
+    def add_candidate(self, file_path):
+        if not self._is_watched(file_path):
+            return
+        with self._lock:
+            if file_path not in self.reported and file_path not in self.candidates:
+                self.candidates[file_path] = None
+
+    def forget(self, file_path):
+        with self._lock:
+            self.reported.discard(file_path)
+            self.candidates.pop(file_path, None)
+
+    def _poll(self):
+        file_paths = set(self._scan())
+        with self._lock:
+            # Reported files that left the folder can be reported again if they come back
+            self.reported &= file_paths
+        for file_path in file_paths:
+            self.add_candidate(file_path)
+        self._last_poll = time.monotonic()
+
+    def _take_settled(self, max_files):
+        now = time.monotonic()
+        settled = []
+        with self._lock:
+            for file_path, state in list(self.candidates.items()):
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    del self.candidates[file_path]
+                    continue
+
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if state is None or state[0] != signature:
+                    # Still being written
+                    self.candidates[file_path] = (signature, now)
+                elif stat.st_size > 0 and now - state[1] >= self.settle_time:
+                    del self.candidates[file_path]
+                    self.reported.add(file_path)
+                    settled.append(file_path)
+                    if len(settled) >= max_files:
+                        break
+        return settled
+
+    def wait_for_files(self, max_files, max_wait):
+        # Block until files settled, then keep collecting for at most max_wait seconds or max_files files
+        batch = []
+        first_file_time = None
+        while True:
+            if self.observer is None and time.monotonic() - self._last_poll >= POLL_INTERVAL:
+                self._poll()
+
+            batch += self._take_settled(max_files - len(batch))
+            if batch and first_file_time is None:
+                first_file_time = time.monotonic()
+            if len(batch) >= max_files or (batch and time.monotonic() - first_file_time >= max_wait):
+                return sorted(batch)
+            time.sleep(0.2)
+
+    def stop(self):
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()